@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, cost=1):
+        """Take `cost` tokens. Returns 0 on success, else seconds until they are available."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        if self.rate <= 0:
+            return 60
+        return (cost - self.tokens) / self.rate
+
+    def refund(self, cost=1):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def is_full(self, now):
+        """Whether the bucket has refilled completely, i.e. is no different from a new one."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Ticket:
+    """A granted admission. Release it exactly once when the LLM work is finished."""
+
+    def __init__(self, controller, user_id, priority, cost):
+        self._controller = controller
+        self.user_id = user_id
+        self.priority = priority
+        self.cost = cost
+        self._released = False
+        self._refunded = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+    def refund(self):
+        """Give the rate-limit tokens back, for requests that did no LLM work."""
+        if not self._refunded:
+            self._refunded = True
+            self._controller._refund(self)
+
+
+class AdmissionController:
+    """Fail-fast admission for LLM work: per-user token buckets plus a global
+    concurrency budget split into priority lanes.
+
+    Interactive requests may use every global slot; batch requests may only use
+    the slots left after the interactive reservation. Nothing queues - callers
+    that don't fit are rejected with a retry hint so they can back off.
+
+    Buckets that have refilled completely are dropped every `sweep_interval`
+    seconds, so only users active within roughly one refill period keep one.
+    """
+
+    def __init__(self, global_concurrency, interactive_reserved, bucket_settings, sweep_interval=60):
+        self.global_concurrency = global_concurrency
+        self.limits = {
+            INTERACTIVE: global_concurrency,
+            BATCH: max(global_concurrency - interactive_reserved, 1),
+        }
+        self.bucket_settings = bucket_settings  # priority -> (rate_per_minute, burst)
+        self.in_flight = {INTERACTIVE: 0, BATCH: 0}
+        self._buckets = {}
+        self.sweep_interval = sweep_interval
+        self._swept = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._swept < self.sweep_interval:
+            return
+        self._swept = now
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+
+    def _bucket(self, user_id, priority):
+        key = (user_id, priority)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self.bucket_settings[priority]
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def acquire(self, user_id, priority, cost=1):
+        if priority not in self.limits:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        with self._lock:
+            self._sweep()
+            bucket = self._bucket(user_id, priority)
+            wait = bucket.try_take(cost)
+            if wait:
+                raise AdmissionRejected("Too many requests, please slow down.", math.ceil(wait))
+
+            # Batch work is admitted against the whole pool's load, so a burst
+            # of chat pushes batch out before it can eat the interactive reserve.
+            if sum(self.in_flight.values()) >= self.limits[priority]:
+                # The user didn't get to spend these tokens.
+                bucket.refund(cost)
+                raise AdmissionRejected("Server is busy, please retry shortly.", 1 if priority == INTERACTIVE else 5)
+
+            self.in_flight[priority] += 1
+            return Ticket(self, user_id, priority, cost)
+
+    def _release(self, ticket):
+        with self._lock:
+            self.in_flight[ticket.priority] -= 1
+
+    def _refund(self, ticket):
+        with self._lock:
+            self._bucket(ticket.user_id, ticket.priority).refund(ticket.cost)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": dict(self.in_flight),
+                "limits": dict(self.limits),
+            }
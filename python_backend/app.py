@@ -1,53 +1,179 @@
+import time
+
+# Cold start is measured from here, before any of the app's own imports run.
+_import_started = time.perf_counter()
+
 import os
+import sys
+import uuid
+import importlib
+import threading
 import requests
-import pdfplumber
-from flask import Flask, request, jsonify, url_for, redirect, flash, send_file, Response, stream_with_context
+import multiprocessing
+import click
+from flask import Flask, Blueprint, abort, current_app, make_response, request, jsonify, url_for, redirect, flash, send_file, Response, stream_with_context, has_request_context
+from flask.cli import with_appcontext
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from config import GEMINI_API_URL, SECRET_KEY
+from werkzeug.exceptions import HTTPException
+from config import (
+    GEMINI_API_BASE, GEMINI_API_KEY, SECRET_KEY, STARTUP_MODE, AUTO_CREATE_SCHEMA, USER_CACHE_TTL_SECONDS,
+    GEMINI_MODEL_TIERS, GEMINI_OPERATION_TIERS, GEMINI_HEDGING,
+    UPLOAD_BATCH_MAX_FILES, UPLOAD_EXTRACT_WORKERS, UPLOAD_SUMMARY_CONCURRENCY,
+    VECTOR_EMBEDDER, VECTOR_EMBEDDING_MODEL, VECTOR_STORE_FOLDER, VECTOR_CHUNK_CHARS, VECTOR_CHUNK_OVERLAP, VECTOR_TOP_K,
+    VECTOR_INDEX_CACHE_SESSIONS,
+    ADMISSION_GLOBAL_CONCURRENCY, ADMISSION_INTERACTIVE_RESERVED,
+    ADMISSION_INTERACTIVE_RATE, ADMISSION_INTERACTIVE_BURST,
+    ADMISSION_BATCH_RATE, ADMISSION_BATCH_BURST,
+    CONTEXT_CACHE_BACKEND, CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_MIN_TOKENS,
+    PROMPT_TOKEN_BUDGETS, DOCUMENT_PAGE_WRITE_BATCH, DOCUMENT_PAGE_READ_BATCH,
+    QUIZ_ANSWER_KEY_CACHE_SIZE, QUIZ_BATCH_MAX_SUBMISSIONS, RESPONSE_CACHE_MAX_BYTES,
+    SQL_METRICS_HEADERS, SQL_QUERY_WARN_THRESHOLD,
+)
+from admission import AdmissionController, AdmissionRejected, INTERACTIVE, BATCH
+from context_cache import (
+    SessionContextCache, GeminiContextCacheBackend, LocalContextCacheBackend, ContextCacheError,
+)
+from prompt_budget import assemble_prompt, estimate_tokens, share_budget, PromptBudgetExceeded, HEAD_TAIL, TAIL
+from model_router import ModelRouter, hedged_call
+import search_index
+from document_text import (
+    iter_filtered_pages, extract_pages_to_file, read_pages_file, HeadTailSample, parse_page_ranges, in_page_ranges,
+)
+from user_cache import UserCache, CachedUser
+from quiz_analytics import AnswerKeyCache, answer_key_from_quiz_data, grade, aggregate
+from response_cache import ResponseCache, make_etag
+import sql_metrics
 import json
 import re
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, event, func, or_
+from sqlalchemy.orm import Session, contains_eager
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from markdown import markdown
-from weasyprint import HTML, CSS
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import wraps
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 
 import logging
 from logging.handlers import RotatingFileHandler
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True) # Enable CORS for credentials
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# File handler for logging
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-file_handler = RotatingFileHandler('logs/aurenlm.log', maxBytes=10240, backupCount=10)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
+# Imported on first use (see markdown_to_pdf, document_text.iter_document_pages
+# and get_vector_store) so workers that never render a PDF or touch the vector
+# index don't pay for them. STARTUP_MODE=preload imports them in create_app
+# instead, so a preforking server loads them once and workers share the pages.
+HEAVY_MODULES = ("markdown", "weasyprint", "pdfplumber", "numpy")
 
-app.logger.info('AurenLM Startup')
-
-app.config['SECRET_KEY'] = SECRET_KEY
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db' # Using SQLite for simplicity
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+db = SQLAlchemy()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login' # Specify the login view function
+login_manager.login_view = 'main.login' # Specify the login view function
+
+bp = Blueprint('main', __name__)
 
 UPLOAD_FOLDER = 'uploads'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Shared pool for Gemini calls that run alongside a request (e.g. generating a
+# notes title while the notes themselves are still streaming, or hedged backups).
+llm_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini")
+
+# Batch upload summaries get their own pool, so a large batch can't queue
+# ahead of interactive calls (and their hedges) on the shared one. Each call
+# holds a batch admission slot while it runs, so the batch lane's size is
+# all the threads it can use.
+UPLOAD_SUMMARY_WORKERS = max(ADMISSION_GLOBAL_CONCURRENCY - ADMISSION_INTERACTIVE_RESERVED, 1)
+upload_summary_executor = ThreadPoolExecutor(max_workers=UPLOAD_SUMMARY_WORKERS, thread_name_prefix="gemini-upload")
+
+# PDF extraction is CPU-bound, so batch uploads extract in worker processes.
+# Created on first use; "spawn" keeps the workers from inheriting app state.
+extraction_executor = None
+extraction_executor_lock = threading.Lock()
+
+def get_extraction_executor():
+    global extraction_executor
+    with extraction_executor_lock:
+        if extraction_executor is None:
+            extraction_executor = ProcessPoolExecutor(
+                max_workers=UPLOAD_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return extraction_executor
+
+def discard_extraction_executor(executor):
+    """Drop a pool that lost a worker (e.g. killed for running out of memory).
+
+    A broken ProcessPoolExecutor refuses all further work, so the next
+    extraction has to start a new one.
+    """
+    global extraction_executor
+    with extraction_executor_lock:
+        if extraction_executor is executor:
+            extraction_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def submit_extraction(*args):
+    """Submit extract_pages_to_file to the extraction pool, replacing the pool if it is broken.
+
+    Returns (future, executor).
+    """
+    executor = get_extraction_executor()
+    try:
+        return executor.submit(extract_pages_to_file, *args), executor
+    except BrokenProcessPool:
+        discard_extraction_executor(executor)
+        executor = get_extraction_executor()
+        return executor.submit(extract_pages_to_file, *args), executor
+
+def _reset_executors_after_fork():
+    # Pool threads and worker processes don't survive a fork; a forked worker
+    # (e.g. gunicorn with preload_app) has to start its own.
+    global llm_executor, upload_summary_executor, extraction_executor
+    llm_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini")
+    upload_summary_executor = ThreadPoolExecutor(max_workers=UPLOAD_SUMMARY_WORKERS, thread_name_prefix="gemini-upload")
+    extraction_executor = None
+
+os.register_at_fork(after_in_child=_reset_executors_after_fork)
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS)
+quiz_answer_keys = AnswerKeyCache(QUIZ_ANSWER_KEY_CACHE_SIZE)
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+model_router = ModelRouter(GEMINI_API_BASE, GEMINI_API_KEY, GEMINI_MODEL_TIERS, GEMINI_OPERATION_TIERS, GEMINI_HEDGING)
+
+admission = AdmissionController(
+    global_concurrency=ADMISSION_GLOBAL_CONCURRENCY,
+    interactive_reserved=ADMISSION_INTERACTIVE_RESERVED,
+    bucket_settings={
+        INTERACTIVE: (ADMISSION_INTERACTIVE_RATE, ADMISSION_INTERACTIVE_BURST),
+        BATCH: (ADMISSION_BATCH_RATE, ADMISSION_BATCH_BURST),
+    },
+)
+
+if CONTEXT_CACHE_BACKEND == "gemini" and GEMINI_API_KEY:
+    context_cache_backend = GeminiContextCacheBackend(GEMINI_API_BASE, GEMINI_API_KEY)
+elif CONTEXT_CACHE_BACKEND == "local":
+    context_cache_backend = LocalContextCacheBackend()
+else:
+    context_cache_backend = None
+session_context_cache = SessionContextCache(context_cache_backend, CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_MIN_TOKENS)
+
+# The vector index needs numpy, so it is built on first use.
+vector_store = None
+vector_store_lock = threading.Lock()
+
+def get_vector_store():
+    global vector_store
+    with vector_store_lock:
+        if vector_store is not None:
+            return vector_store
+        from vector_index import VectorStore, GeminiEmbedder, HashingEmbedder
+        if VECTOR_EMBEDDER == "gemini" and GEMINI_API_KEY:
+            embedder = GeminiEmbedder(GEMINI_API_BASE, GEMINI_API_KEY, model=VECTOR_EMBEDDING_MODEL)
+        else:
+            embedder = HashingEmbedder()
+        vector_store = VectorStore(VECTOR_STORE_FOLDER, embedder, VECTOR_CHUNK_CHARS, VECTOR_CHUNK_OVERLAP, VECTOR_INDEX_CACHE_SESSIONS)
+        return vector_store
 
 # User model
 class User(db.Model, UserMixin):
@@ -64,6 +190,11 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"User('{self.username}')"
 
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
 # Chat Session model
 class ChatSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -96,12 +227,30 @@ class UploadedFile(db.Model):
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     summary = db.Column(db.Text, nullable=True)
-    full_text_content = db.Column(db.Text, nullable=True) # Store full text for context
+    full_text_content = db.Column(db.Text, nullable=True) # Full text of uploads made before DocumentPage; newer uploads leave it empty
     uploaded_at = db.Column(db.DateTime, default=db.func.current_timestamp(), index=True)
 
     def __repr__(self):
         return f"UploadedFile(Session ID: {self.session_id}, Filename: {self.filename})"
 
+# Document Page model: the filtered text of one page of an uploaded file
+class DocumentPage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('file_id', 'page_number'),)
+
+    def __repr__(self):
+        return f"DocumentPage(File ID: {self.file_id}, Page: {self.page_number})"
+
+@event.listens_for(UploadedFile, "before_delete")
+def delete_document_pages(mapper, connection, target):
+    # Pages aren't mapped as a relationship, so deleting a long document
+    # doesn't load every page first; remove them in one statement instead.
+    connection.execute(DocumentPage.__table__.delete().where(DocumentPage.file_id == target.id))
+
 # Mindmap model
 class Mindmap(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -134,12 +283,51 @@ class QuizAttempt(db.Model):
     score = db.Column(db.Float, nullable=False)
     attempted_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
-    quiz = db.relationship('Quiz', backref=db.backref('attempts', lazy=True))
+    # Deleting a quiz deletes its attempts in bulk (see delete_quiz_results), so the ORM leaves them alone.
+    quiz = db.relationship('Quiz', backref=db.backref('attempts', lazy=True, passive_deletes='all'))
     user = db.relationship('User', backref=db.backref('quiz_attempts', lazy=True))
 
     def __repr__(self):
         return f"QuizAttempt(Quiz ID: {self.quiz_id}, User ID: {self.user_id}, Score: {self.score})"
 
+# Quiz Question Stat model: running totals over every attempt at one question of a quiz
+class QuizQuestionStat(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    question_index = db.Column(db.Integer, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('quiz_id', 'question_index'),)
+
+    def __repr__(self):
+        return f"QuizQuestionStat(Quiz ID: {self.quiz_id}, Question: {self.question_index})"
+
+# User Quiz Stat model: running totals over one user's attempts at one quiz
+class UserQuizStat(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Float, nullable=False, default=0.0)
+    best_score = db.Column(db.Float, nullable=False, default=0.0)
+    last_score = db.Column(db.Float, nullable=False, default=0.0)
+    last_attempted_at = db.Column(db.DateTime, nullable=True)
+    questions_answered = db.Column(db.Integer, nullable=False, default=0)
+    questions_correct = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'quiz_id'),)
+
+    def __repr__(self):
+        return f"UserQuizStat(User ID: {self.user_id}, Quiz ID: {self.quiz_id}, Attempts: {self.attempts})"
+
+@event.listens_for(Quiz, "before_delete")
+def delete_quiz_results(mapper, connection, target):
+    for table in (QuizAttempt.__table__, QuizQuestionStat.__table__, UserQuizStat.__table__):
+        connection.execute(table.delete().where(table.c.quiz_id == target.id))
+    quiz_answer_keys.invalidate(target.id)
+
 # Session Notes model
 class SessionNote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -154,34 +342,294 @@ class SessionNote(db.Model):
     def __repr__(self):
         return f"SessionNote(Session ID: {self.session_id}, Created At: {self.created_at})"
 
+# LLM Usage model: one row per Gemini call, to tie cost and latency to prompt size
+class LLMUsage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id', ondelete='SET NULL'), nullable=True, index=True)
+    operation = db.Column(db.String(40), nullable=False)
+    model = db.Column(db.String(64), nullable=True)
+    hedged = db.Column(db.Boolean, nullable=False, default=False)
+    estimated_prompt_tokens = db.Column(db.Integer, nullable=True)
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    cached_tokens = db.Column(db.Integer, nullable=True)
+    output_tokens = db.Column(db.Integer, nullable=True)
+    total_tokens = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    first_token_ms = db.Column(db.Integer, nullable=True)
+    succeeded = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp(), index=True)
 
+    def __repr__(self):
+        return f"LLMUsage(Operation: {self.operation}, Session ID: {self.session_id}, Total Tokens: {self.total_tokens})"
 
+# Cache Version model: a change counter per cached response scope (see cache_scopes_for)
+class CacheVersion(db.Model):
+    scope = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
 
-
-@app.route("/health")
+    def __repr__(self):
+        return f"CacheVersion('{self.scope}', {self.version})"
+
+def cache_scopes_for(obj):
+    """The cached list responses that change when `obj` is written."""
+    if isinstance(obj, ChatSession):
+        # A session's own scopes are bumped when it is deleted too, so a reused id never revives old ETags.
+        return [f"user:{obj.user_id}:sessions", f"session:{obj.id}:quizzes", f"session:{obj.id}:notes"]
+    if isinstance(obj, Quiz):
+        return [f"session:{obj.session_id}:quizzes"]
+    if isinstance(obj, SessionNote):
+        return [f"session:{obj.session_id}:notes"]
+    return []
+
+@event.listens_for(Session, "after_flush")
+def bump_cache_versions(session, flush_context):
+    # Runs inside the flush's transaction, so a version only moves if the write commits.
+    scopes = set()
+    for obj in list(session.new) + list(session.deleted):
+        scopes.update(cache_scopes_for(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            scopes.update(cache_scopes_for(obj))
+    if not scopes:
+        return
+    table = CacheVersion.__table__
+    stmt = dialect_insert(table, session.connection().dialect.name)
+    stmt = stmt.on_conflict_do_update(index_elements=["scope"], set_={"version": table.c.version + 1})
+    session.connection().execute(stmt, [{"scope": scope, "version": 1} for scope in sorted(scopes)])
+
+
+
+
+
+@bp.route("/health")
 def health_check():
     return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()}), 200
 
-@app.route("/ready")
+@bp.route("/ready")
 def readiness_check():
     try:
         # Check database connection
         db.session.execute(db.text('SELECT 1'))
-        return jsonify({"status": "ready", "database": "connected"}), 200
+        startup = dict(current_app.extensions['aurenlm_startup'])
+        startup["heavy_modules_loaded"] = [name for name in HEAVY_MODULES if name in sys.modules]
+        return jsonify({"status": "ready", "database": "connected", "llm_admission": admission.stats(), "startup": startup}), 200
     except Exception as e:
-        app.logger.error(f"Readiness check failed: {e}")
+        current_app.logger.error(f"Readiness check failed: {e}")
         return jsonify({"status": "not ready", "database": "disconnected", "error": str(e)}), 503
 
+def load_cached_user(user_id):
+    row = db.session.query(User.id, User.username).filter_by(id=user_id).first()
+    return CachedUser(row.id, row.username) if row else None
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id), load_cached_user)
+
+def get_owned_or_abort(model, object_id):
+    """Load a session-owned row and check it belongs to the current user, in one query.
+
+    `model` is ChatSession or a model with a `session` relationship to one
+    (UploadedFile, SessionNote, Quiz); for the latter the session is loaded
+    in the same query. Aborts with 404 if the row doesn't exist and 403 if
+    it isn't the current user's.
+    """
+    if model is ChatSession:
+        obj = db.session.get(ChatSession, object_id)
+        owner_id = obj.user_id if obj is not None else None
+    else:
+        obj = (
+            model.query.join(model.session)
+            .options(contains_eager(model.session))
+            .filter(model.id == object_id)
+            .first()
+        )
+        owner_id = obj.session.user_id if obj is not None else None
+    if obj is None:
+        abort(404)
+    if owner_id != current_user.id:
+        abort(make_response(jsonify({"message": "Unauthorized"}), 403))
+    return obj
+
+def llm_admission(priority):
+    """Gate a Gemini-bound route behind the admission controller.
+
+    Must be applied below @login_required. Rejected callers get an immediate
+    429 with Retry-After. The slot is held until the response is closed, so
+    streaming responses keep it for as long as they are streaming. Requests
+    the view turns away with a 4xx (bad input, missing or foreign objects,
+    oversized prompts) get their rate-limit token back.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            try:
+                ticket = admission.acquire(current_user.id, priority)
+            except AdmissionRejected as e:
+                current_app.logger.info(f"Admission rejected ({priority}) for user {current_user.id}: {e.reason}")
+                response = jsonify({"message": e.reason, "retry_after": e.retry_after})
+                response.status_code = 429
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except (HTTPException, PromptBudgetExceeded) as e:
+                ticket.release()
+                if isinstance(e, PromptBudgetExceeded) or 400 <= (e.code or 500) < 500:
+                    ticket.refund()
+                raise
+            except BaseException:
+                ticket.release()
+                raise
+            if 400 <= response.status_code < 500:
+                ticket.refund()
+            response.call_on_close(ticket.release)
+            return response
+        return wrapped
+    return decorator
+
+@bp.before_app_request
+def start_sql_metrics():
+    sql_metrics.start_request()
+
+@bp.after_app_request
+def add_sql_metrics_headers(response):
+    # Streaming responses only count the statements run before the body started.
+    stats = sql_metrics.request_stats()
+    if stats is not None and current_app.config['SQL_METRICS_HEADERS']:
+        response.headers["X-SQL-Queries"] = str(stats.count)
+        response.headers["X-SQL-Time-ms"] = f"{stats.total_ms:.1f}"
+    return response
+
+@bp.teardown_app_request
+def log_sql_metrics(exc):
+    # Runs after a streamed body has finished, so this covers the whole request.
+    stats = sql_metrics.request_stats()
+    if stats is None or not stats.count:
+        return
+    message = f"SQL {request.method} {request.path}: {stats.count} queries in {stats.total_ms:.1f} ms"
+    if stats.count > current_app.config['SQL_QUERY_WARN_THRESHOLD']:
+        current_app.logger.warning(message)
+    else:
+        current_app.logger.info(message)
+
+@bp.app_errorhandler(PromptBudgetExceeded)
+def handle_prompt_budget_exceeded(e):
+    return jsonify({"message": "Request is too large to process", "details": str(e)}), 413
+
+def init_db(app):
+    """Create the database tables and the full-text search index."""
+    with app.app_context():
+        db.create_all()
+        search_index.init_search_index(db.engine)
+        # Attempts made before the aggregate tables existed.
+        if db.session.query(QuizAttempt.id).first() and not db.session.query(UserQuizStat.id).first():
+            rebuild_quiz_stats()
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create the database tables and search index (`flask --app app init-db`)."""
+    init_db(current_app._get_current_object())
+    click.echo("Initialized the database.")
+
+def configure_logging(app):
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    # File handler for logging
+    file_handler = RotatingFileHandler('logs/aurenlm.log', maxBytes=10240, backupCount=10)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+
+def preload_heavy_modules(logger):
+    """Import the modules in HEAVY_MODULES now rather than on first use. Returns their load times in ms."""
+    timings = {}
+    for name in HEAVY_MODULES:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except (ImportError, OSError) as e:
+            # e.g. weasyprint without its system libraries; the feature fails on use instead.
+            logger.warning(f"Could not preload {name}: {e}")
+            continue
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+def create_app(test_config=None):
+    """Build the Flask app.
+
+    STARTUP_MODE "lazy" (the default) defers PDF, markdown and numpy imports to
+    first use; "preload" imports them up front, for servers that load the app
+    once and fork workers from it (see gunicorn.conf.py). The schema is only
+    created here when AUTO_CREATE_SCHEMA is set; otherwise run `flask init-db`.
+    """
+    factory_started = time.perf_counter()
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db' # Using SQLite for simplicity
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['STARTUP_MODE'] = STARTUP_MODE
+    app.config['AUTO_CREATE_SCHEMA'] = AUTO_CREATE_SCHEMA
+    app.config['SQL_METRICS_HEADERS'] = SQL_METRICS_HEADERS
+    app.config['SQL_QUERY_WARN_THRESHOLD'] = SQL_QUERY_WARN_THRESHOLD
+    if test_config:
+        app.config.update(test_config)
+
+    configure_logging(app)
+    CORS(app, supports_credentials=True) # Enable CORS for credentials
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    app.cli.add_command(init_db_command)
+
+    if not os.path.exists(app.config['UPLOAD_FOLDER']):
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+
+    preloaded = {}
+    if app.config['STARTUP_MODE'] == 'preload':
+        preloaded = preload_heavy_modules(app.logger)
+    if app.config['AUTO_CREATE_SCHEMA']:
+        init_db(app)
+
+    now = time.perf_counter()
+    app.extensions['aurenlm_startup'] = {
+        "mode": app.config['STARTUP_MODE'],
+        "import_ms": round((factory_started - _import_started) * 1000, 1),
+        "create_app_ms": round((now - factory_started) * 1000, 1),
+        "total_ms": round((now - _import_started) * 1000, 1),
+        "preloaded_ms": preloaded,
+    }
+    app.logger.info(f"AurenLM Startup: {app.extensions['aurenlm_startup']}")
+    return app
+
+@bp.route("/search", methods=["GET"])
+@login_required
+def search():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"message": "Search query is required"}), 400
+    if not search_index.is_available(db.engine):
+        return jsonify({"message": "Search is not available on this database"}), 501
+
+    kinds = request.args.get("type")
+    if kinds:
+        kinds = [k.strip() for k in kinds.split(",")]
+        unknown = [k for k in kinds if k not in search_index.INDEXES]
+        if unknown:
+            return jsonify({"message": f"Unknown search type: {', '.join(repr(k) for k in unknown)}", "types": list(search_index.INDEXES)}), 400
+    else:
+        kinds = None
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+    results = search_index.search(db.session.connection(), current_user.id, query, kinds=kinds, limit=limit)
+    return jsonify({"query": query, "results": results}), 200
 
 # --- Authentication Routes ---
-@app.route("/register", methods=["POST"])
+@bp.route("/register", methods=["POST"])
 def register():
     data = request.json
     username = data.get('username')
@@ -199,7 +647,7 @@ def register():
     db.session.commit()
     return jsonify({"message": "User registered successfully"}), 201
 
-@app.route("/login", methods=["POST"])
+@bp.route("/login", methods=["POST"])
 def login():
     data = request.json
     username = data.get('username')
@@ -213,13 +661,13 @@ def login():
     else:
         return jsonify({"message": "Invalid username or password"}), 401
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     return jsonify({"message": "Logged out successfully"}), 200
 
-@app.route("/current_user")
+@bp.route("/current_user")
 def get_current_user():
     if current_user.is_authenticated:
         return jsonify({"username": current_user.username, "id": current_user.id}), 200
@@ -227,27 +675,77 @@ def get_current_user():
         return jsonify({"username": None}), 200
 
 # --- Chat Session Management Routes ---
-@app.route("/sessions", methods=["GET"])
+def cache_version(scope):
+    return db.session.query(CacheVersion.version).filter_by(scope=scope).scalar() or 0
+
+def session_cache_version_or_abort(session_id, kind):
+    """Check session ownership and read the version of one of its scopes in a single query.
+
+    Returns (scope, version). Aborts with 404 or 403 like get_owned_or_abort.
+    """
+    scope = f"session:{session_id}:{kind}"
+    row = (
+        db.session.query(ChatSession.user_id, CacheVersion.version)
+        .outerjoin(CacheVersion, CacheVersion.scope == scope)
+        .filter(ChatSession.id == session_id)
+        .first()
+    )
+    if row is None:
+        abort(404)
+    if row.user_id != current_user.id:
+        abort(make_response(jsonify({"message": "Unauthorized"}), 403))
+    return scope, row.version or 0
+
+def versioned_json(scope, version, build):
+    """Respond with build()'s JSON for `scope` at `version`, under a strong ETag.
+
+    A matching If-None-Match gets a 304 without calling build(). Otherwise
+    the serialized body is reused across requests until the version changes.
+    """
+    # Bodies with absolute URLs depend on the host they were requested through.
+    variant = request.url_root
+    etag = make_etag(scope, version, variant)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        key = (scope, version, variant)
+        body = response_cache.get(key)
+        if body is None:
+            body = (current_app.json.dumps(build()) + "\n").encode("utf-8")
+            response_cache.put(key, body)
+        response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it on every poll.
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@bp.route("/sessions", methods=["GET"])
 @login_required
 def get_sessions():
-    sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.created_at.desc()).all()
-    return jsonify([
-        {"id": s.id, "title": s.title, "created_at": s.created_at.isoformat()}
-        for s in sessions
-    ]), 200
+    scope = f"user:{current_user.id}:sessions"
+    user_id = current_user.id
 
-@app.route("/sessions", methods=["POST"])
+    def build():
+        sessions = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.created_at.desc()).all()
+        return [
+            {"id": s.id, "title": s.title, "created_at": s.created_at.isoformat()}
+            for s in sessions
+        ]
+
+    return versioned_json(scope, cache_version(scope), build)
+
+@bp.route("/sessions", methods=["POST"])
 @login_required
 def create_session():
     data = request.json
-    title = data.get('title', f"New Session {len(current_user.chat_sessions) + 1}")
+    title = data.get('title', f"New Session {ChatSession.query.filter_by(user_id=current_user.id).count() + 1}")
 
     new_session = ChatSession(user_id=current_user.id, title=title)
     db.session.add(new_session)
     db.session.commit()
     return jsonify({"message": "Session created", "id": new_session.id, "title": new_session.title}), 201
 
-@app.route("/sessions/<int:session_id>", methods=["GET"])
+@bp.route("/sessions/<int:session_id>", methods=["GET"])
 @login_required
 def get_session_data(session_id):
     session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
@@ -255,6 +753,7 @@ def get_session_data(session_id):
     messages = ChatMessage.query.filter_by(session_id=session.id).order_by(ChatMessage.timestamp.asc()).all()
     files = UploadedFile.query.filter_by(session_id=session.id).order_by(UploadedFile.uploaded_at.asc()).all()
     mindmap = Mindmap.query.filter_by(session_id=session.id).first()
+    page_counts = document_page_counts(files)
 
     return jsonify({
         "id": session.id,
@@ -265,52 +764,97 @@ def get_session_data(session_id):
             for m in messages
         ],
         "files": [
-            {"id": f.id, "filename": f.filename, "summary": f.summary, "fullText": f.full_text_content, "uploaded_at": f.uploaded_at.isoformat()}
+            {"id": f.id, "filename": f.filename, "summary": f.summary, "page_count": page_counts.get(f.id, 0), "uploaded_at": f.uploaded_at.isoformat()}
             for f in files
         ],
         "mindmap": mindmap.mindmap_data if mindmap else None
     }), 200
 
-@app.route("/sessions/<int:session_id>", methods=["DELETE"])
+def delete_session_contents(session_id):
+    """Bulk-delete everything that belongs to a session, in a fixed number of statements.
+
+    Deleting the session through the ORM cascade instead would load every
+    child row and run the per-file and per-quiz delete hooks one at a time.
+    """
+    file_ids = db.select(UploadedFile.id).where(UploadedFile.session_id == session_id)
+    quiz_ids = [row.id for row in db.session.query(Quiz.id).filter_by(session_id=session_id)]
+    db.session.execute(DocumentPage.__table__.delete().where(DocumentPage.file_id.in_(file_ids)))
+    if quiz_ids:
+        for table in (QuizAttempt.__table__, QuizQuestionStat.__table__, UserQuizStat.__table__):
+            db.session.execute(table.delete().where(table.c.quiz_id.in_(quiz_ids)))
+    for model in (ChatMessage, UploadedFile, Mindmap, Quiz, SessionNote):
+        db.session.execute(model.__table__.delete().where(model.__table__.c.session_id == session_id))
+    for quiz_id in quiz_ids:
+        quiz_answer_keys.invalidate(quiz_id)
+
+@bp.route("/sessions/<int:session_id>", methods=["DELETE"])
 @login_required
 def delete_session(session_id):
     session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
+    delete_session_contents(session.id)
+    # The cascades now find nothing left to delete.
     db.session.delete(session)
     db.session.commit()
+    session_context_cache.invalidate(session_id)
+    get_vector_store().drop_session(session_id)
     return jsonify({"message": "Session deleted"}), 200
 
-@app.route("/api/documents/<int:document_id>", methods=["DELETE"])
+@bp.route("/api/documents/<int:document_id>", methods=["DELETE"])
 @login_required
 def delete_document(document_id):
-    document = UploadedFile.query.get_or_404(document_id)
-
-    # Check if the document belongs to a session owned by the current user
-    if document.session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    document = get_owned_or_abort(UploadedFile, document_id)
 
+    session_id = document.session_id
     db.session.delete(document)
     db.session.commit()
+    session_context_cache.invalidate(session_id)
+    get_vector_store().remove_document(session_id, document_id)
 
     return jsonify({"message": "Document deleted successfully"}), 200
 
-@app.route("/api/sessions/<int:session_id>/generate-title", methods=["POST"])
+@bp.route("/api/documents/<int:document_id>/pages", methods=["GET"])
 @login_required
+def get_document_pages(document_id):
+    """Return a document's pages, optionally just `?pages=1-5,9`, at most `limit` per request."""
+    document = get_owned_or_abort(UploadedFile, document_id)
+    try:
+        page_ranges = parse_page_ranges(request.args["pages"]) if request.args.get("pages") else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+
+    page_iter = iter_file_pages(document, page_ranges)
+    pages = [{"page_number": page_number, "content": text} for page_number, text in islice(page_iter, limit)]
+    page_iter.close()
+
+    return jsonify({
+        "file_id": document.id,
+        "filename": document.filename,
+        "page_count": document_page_counts([document]).get(document.id, 0),
+        "pages": pages,
+    }), 200
+
+@bp.route("/api/sessions/<int:session_id>/generate-title", methods=["POST"])
+@login_required
+@llm_admission(INTERACTIVE)
 def generate_title(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session = get_owned_or_abort(ChatSession, session_id)
 
-    first_file = session.files[0] if session.files else None
+    first_file = UploadedFile.query.filter_by(session_id=session.id).order_by(UploadedFile.id).first()
+    # The title prompt only has room for the start of the document.
+    first_text = document_texts([first_file], [(1, TITLE_PAGES)]).get(first_file.id) if first_file else None
 
-    if not first_file or not first_file.full_text_content:
+    if not first_text:
         return jsonify({"message": "No content available to generate title."}), 400
 
-    title_prompt = f"""Generate a short, concise title (5-10 words) for a document with the following content. The title should capture the main subject of the text. Respond with only the title and nothing else.
-
-Content:
-{first_file.full_text_content[:2000]}"""
+    title_prompt = build_prompt(
+        "title",
+        system="Generate a short, concise title (5-10 words) for a document with the following content. The title should capture the main subject of the text. Respond with only the title and nothing else.",
+        documents=[first_text],
+        document_header="Content:",
+    )
 
-    title_response = get_gemini_response(title_prompt)
+    title_response = call_gemini("title", title_prompt, session_id=session.id)
 
     if "error" in title_response:
         return jsonify({"message": "Error generating title", "details": title_response["error"]}), 500
@@ -321,27 +865,28 @@ Content:
 
     return jsonify({"id": session.id, "title": new_title})
 
-@app.route("/api/sessions/<int:session_id>/generate_notes", methods=["POST"])
+@bp.route("/api/sessions/<int:session_id>/generate_notes", methods=["POST"])
 @login_required
+@llm_admission(BATCH)
 def generate_session_notes(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session = get_owned_or_abort(ChatSession, session_id)
 
     data = request.json
     style = data.get("style", "concise")
     custom_text = data.get("custom_text")
     custom_title = data.get("custom_title")
 
-    if custom_text:
-        all_docs_text = custom_text
-    else:
-        all_docs_text = "\n\n".join([f.full_text_content for f in session.files if f.full_text_content])
+    try:
+        file_id, page_ranges = document_selection(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
-    if not all_docs_text:
+    documents = session_documents(session, "notes", custom_text, data.get("topic"), file_id, page_ranges)
+
+    if not documents:
         return jsonify({"message": "No document content available in this session to generate notes from."}), 400
 
-    notes_response = generate_notes_from_text(all_docs_text, style)
+    notes_response = generate_notes_from_text(documents, style, session_id=session.id)
 
     if "error" in notes_response:
         return jsonify({"message": "Error generating notes", "details": notes_response["error"]}), 500
@@ -349,62 +894,138 @@ def generate_session_notes(session_id):
     markdown_content = notes_response["text"]
     generated_title = custom_title if custom_title else notes_response["title"]
 
-    # Generate PDF
-    pdf_filename = f"session_notes_{session_id}_{style}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
     try:
-        markdown_to_pdf(markdown_content, pdf_path)
+        new_session_note = save_session_note(session.id, style, generated_title, markdown_content)
     except Exception as e:
         return jsonify({"message": "Error converting notes to PDF", "details": str(e)}), 500
 
-    new_session_note = SessionNote(
-        session_id=session.id,
-        title=generated_title,
-        markdown_content=markdown_content,
-        pdf_path=pdf_path
-    )
-    db.session.add(new_session_note)
-    db.session.commit()
+    return jsonify({"message": "Session notes generated successfully", "id": new_session_note.id, "title": new_session_note.title, "pdf_url": url_for('.get_session_note_pdf', session_note_id=new_session_note.id)}), 201
+
+@bp.route("/api/sessions/<int:session_id>/generate_notes/stream", methods=["POST"])
+@login_required
+@llm_admission(BATCH)
+def stream_session_notes(session_id):
+    """Stream notes as newline-delimited JSON events while Gemini writes them.
+
+    Events are ``chunk`` (markdown text), ``title`` (as soon as the parallel
+    title call finishes), then a final ``done`` with the saved note, or
+    ``error`` if generation or PDF conversion fails.
+    """
+    session = get_owned_or_abort(ChatSession, session_id)
 
-    return jsonify({"message": "Session notes generated successfully", "id": new_session_note.id, "title": new_session_note.title, "pdf_url": url_for('get_session_note_pdf', session_note_id=new_session_note.id)}), 201
+    data = request.json
+    style = data.get("style", "concise")
+    custom_text = data.get("custom_text")
+    custom_title = data.get("custom_title")
+
+    try:
+        file_id, page_ranges = document_selection(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    documents = session_documents(session, "notes", custom_text, data.get("topic"), file_id, page_ranges)
+
+    if not documents:
+        return jsonify({"message": "No document content available in this session to generate notes from."}), 400
+
+    notes_prompt = build_notes_prompt(documents, style)
+
+    def event(payload):
+        return json.dumps(payload) + "\n"
+
+    # The ORM objects aren't usable once the view has returned and the body is streaming.
+    session_id = session.id
+    user_id = current_user.id
 
-@app.route("/api/sessions/<int:session_id>/notes", methods=["GET"])
+    def generate():
+        markdown_parts = []
+        title = custom_title
+        title_future = None
+        title_prompt = None
+        usage = {}
+        try:
+            for chunk in get_gemini_streaming_response(notes_prompt.text, usage=usage, model=model_router.model_for("notes")):
+                if isinstance(chunk, GeminiStreamError):
+                    record_llm_usage("notes", session_id, notes_prompt.estimated_tokens, usage, user_id=user_id)
+                    yield event({"type": "error", "message": "Error generating notes", "details": str(chunk)})
+                    return
+
+                markdown_parts.append(chunk)
+                yield event({"type": "chunk", "text": chunk})
+
+                # Start the title as soon as the notes have an opening, rather
+                # than waiting for the whole document to be written.
+                if title is None and title_future is None:
+                    title_prompt = build_notes_title_prompt(chunk, documents[0])
+                    title_future = llm_executor.submit(get_gemini_response, title_prompt.text, model=model_router.model_for("notes_title"))
+                elif title is None and title_future.done():
+                    title = parse_generated_title(title_future.result())
+                    yield event({"type": "title", "title": title})
+
+            record_llm_usage("notes", session_id, notes_prompt.estimated_tokens, usage, user_id=user_id)
+            markdown_content = "".join(markdown_parts)
+            if not markdown_content.strip():
+                yield event({"type": "error", "message": "Error generating notes", "details": "Gemini returned no content"})
+                return
+
+            if title is None:
+                title = parse_generated_title(title_future.result())
+                yield event({"type": "title", "title": title})
+            if title_future is not None:
+                record_llm_usage("notes_title", session_id, title_prompt.estimated_tokens, title_future.result(), user_id=user_id)
+
+            try:
+                new_session_note = save_session_note(session_id, style, title, markdown_content)
+            except Exception as e:
+                yield event({"type": "error", "message": "Error converting notes to PDF", "details": str(e)})
+                return
+
+            yield event({
+                "type": "done",
+                "id": new_session_note.id,
+                "title": new_session_note.title,
+                "pdf_url": url_for('.get_session_note_pdf', session_note_id=new_session_note.id)
+            })
+        finally:
+            if title_future is not None:
+                title_future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@bp.route("/api/sessions/<int:session_id>/notes", methods=["GET"])
 @login_required
 def get_session_notes(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
-    
-    notes = SessionNote.query.filter_by(session_id=session.id).order_by(SessionNote.created_at.desc()).all()
-    return jsonify([
-        {
-            "id": n.id,
-            "session_id": n.session_id,
-            "title": n.title,
-            "created_at": n.created_at.isoformat(),
-            "pdf_url": url_for('get_session_note_pdf', session_note_id=n.id, _external=True) if n.pdf_path else None
-        }
-        for n in notes
-    ]), 200
-
-@app.route("/api/session_notes/<int:session_note_id>/pdf", methods=["GET"])
+    scope, version = session_cache_version_or_abort(session_id, "notes")
+
+    def build():
+        notes = SessionNote.query.filter_by(session_id=session_id).order_by(SessionNote.created_at.desc()).all()
+        return [
+            {
+                "id": n.id,
+                "session_id": n.session_id,
+                "title": n.title,
+                "created_at": n.created_at.isoformat(),
+                "pdf_url": url_for('.get_session_note_pdf', session_note_id=n.id, _external=True) if n.pdf_path else None
+            }
+            for n in notes
+        ]
+
+    return versioned_json(scope, version, build)
+
+@bp.route("/api/session_notes/<int:session_note_id>/pdf", methods=["GET"])
 @login_required
 def get_session_note_pdf(session_note_id):
-    session_note = SessionNote.query.get_or_404(session_note_id)
-    if session_note.session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session_note = get_owned_or_abort(SessionNote, session_note_id)
     
     if not session_note.pdf_path or not os.path.exists(session_note.pdf_path):
         return jsonify({"message": "PDF not found"}), 404
     
     return send_file(session_note.pdf_path, as_attachment=True, download_name=os.path.basename(session_note.pdf_path))
 
-@app.route("/api/session_notes/<int:session_note_id>", methods=["DELETE"])
+@bp.route("/api/session_notes/<int:session_note_id>", methods=["DELETE"])
 @login_required
 def delete_session_note(session_note_id):
-    session_note = SessionNote.query.get_or_404(session_note_id)
-    if session_note.session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session_note = get_owned_or_abort(SessionNote, session_note_id)
     
     if session_note.pdf_path and os.path.exists(session_note.pdf_path):
         os.remove(session_note.pdf_path)
@@ -413,12 +1034,10 @@ def delete_session_note(session_note_id):
     db.session.commit()
     return jsonify({"message": "Session note deleted successfully"}), 200
 
-@app.route("/api/sessions/<int:session_id>/rename", methods=["PUT"])
+@bp.route("/api/sessions/<int:session_id>/rename", methods=["PUT"])
 @login_required
 def rename_session(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session = get_owned_or_abort(ChatSession, session_id)
 
     data = request.json
     new_title = data.get("title")
@@ -431,17 +1050,144 @@ def rename_session(session_id):
 
     return jsonify({"id": session.id, "title": session.title})
 
-def get_gemini_response(prompt):
+def summarize_usage(query):
+    rows = query.with_entities(
+        LLMUsage.operation,
+        db.func.count(LLMUsage.id),
+        db.func.sum(LLMUsage.estimated_prompt_tokens),
+        db.func.sum(LLMUsage.prompt_tokens),
+        db.func.sum(LLMUsage.cached_tokens),
+        db.func.sum(LLMUsage.output_tokens),
+        db.func.avg(LLMUsage.latency_ms),
+        db.func.avg(LLMUsage.first_token_ms),
+    ).group_by(LLMUsage.operation).all()
+    return [
+        {
+            "operation": operation,
+            "requests": requests_count,
+            "estimated_prompt_tokens": estimated or 0,
+            "prompt_tokens": prompt_tokens or 0,
+            "cached_tokens": cached or 0,
+            "output_tokens": output or 0,
+            "avg_latency_ms": round(avg_latency) if avg_latency is not None else None,
+            "avg_first_token_ms": round(avg_first_token) if avg_first_token is not None else None,
+        }
+        for operation, requests_count, estimated, prompt_tokens, cached, output, avg_latency, avg_first_token in rows
+    ]
+
+@bp.route("/api/usage", methods=["GET"])
+@login_required
+def get_usage():
+    return jsonify(summarize_usage(LLMUsage.query.filter_by(user_id=current_user.id))), 200
+
+@bp.route("/api/sessions/<int:session_id>/usage", methods=["GET"])
+@login_required
+def get_session_usage(session_id):
+    session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
+    return jsonify(summarize_usage(LLMUsage.query.filter_by(session_id=session.id))), 200
+
+def build_gemini_request(prompt, cached_content=None):
+    data = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    if cached_content:
+        data["cachedContent"] = cached_content
+    return data
+
+def build_prompt(operation, **sections):
+    """Assemble a prompt within the operation's token budget (see prompt_budget.assemble_prompt)."""
+    prompt = assemble_prompt(operation, PROMPT_TOKEN_BUDGETS[operation], **sections)
+    if prompt.truncated:
+        print(f"Prompt for {operation} truncated to ~{prompt.estimated_tokens} tokens: {prompt.truncated}")
+    return prompt
+
+def extract_usage(json_response):
+    usage = json_response.get("usageMetadata") or {}
+    return {
+        "prompt_tokens": usage.get("promptTokenCount"),
+        "cached_tokens": usage.get("cachedContentTokenCount"),
+        "output_tokens": usage.get("candidatesTokenCount"),
+        "total_tokens": usage.get("totalTokenCount"),
+    }
+
+def record_llm_usage(operation, session_id, estimated_tokens, result, user_id=None):
+    """Store a usage row for one Gemini call.
+
+    `result` is a get_gemini_response() result or the usage dict filled in by
+    get_gemini_streaming_response(). Streaming callers must pass `user_id`,
+    since current_user can't be refreshed once the view has returned.
+    """
+    if user_id is None and has_request_context() and current_user.is_authenticated:
+        user_id = current_user.id
+    usage = result.get("usage") or {}
+    db.session.add(LLMUsage(
+        user_id=user_id,
+        session_id=session_id,
+        operation=operation,
+        model=result.get("model"),
+        hedged=result.get("hedged", False),
+        estimated_prompt_tokens=estimated_tokens,
+        prompt_tokens=usage.get("prompt_tokens"),
+        cached_tokens=usage.get("cached_tokens"),
+        output_tokens=usage.get("output_tokens"),
+        total_tokens=usage.get("total_tokens"),
+        latency_ms=result.get("latency_ms"),
+        first_token_ms=result.get("first_token_ms"),
+        succeeded="error" not in result,
+    ))
+    db.session.commit()
+
+def call_gemini(operation, prompt, session_id=None, cached_content=None, prompt_text=None):
+    """Send an assembled prompt to the operation's model and record its usage.
+
+    Operations configured for hedging fire a backup request if the first one
+    is slower than that operation's recent p95; both calls get a usage row.
+    `prompt_text` overrides the text sent (e.g. just the turn when the
+    documents are in `cached_content`).
+    """
+    prompt_text = prompt_text or prompt.text
+    model = model_router.model_for(operation)
+
+    def call():
+        return get_gemini_response(prompt_text, cached_content=cached_content, model=model)
+
+    estimated_tokens = estimate_tokens(prompt_text)
+    delay = model_router.hedge_delay(operation, model)
+    if delay is None:
+        response = call()
+        latency_ms = response.get("latency_ms")
+    else:
+        app = current_app._get_current_object()
+        user_id = current_user.id if current_user.is_authenticated else None
+
+        def record_discarded(result, is_primary):
+            # The losing call is billed too. A primary that lost by being slow
+            # is also a real latency sample; leaving it out would drag p95 down.
+            if is_primary and "error" not in result:
+                model_router.observe(operation, model, result["latency_ms"])
+            with app.app_context():
+                record_llm_usage(operation, session_id, estimated_tokens, dict(result, hedged=True), user_id=user_id)
+
+        response, hedged, latency_ms = hedged_call(llm_executor, call, delay, lambda r: "error" not in r, on_discarded=record_discarded)
+        response["hedged"] = hedged
+    if "error" not in response:
+        # Measured from when the primary was sent, so a backup's win includes the delay it waited.
+        model_router.observe(operation, model, latency_ms)
+
+    record_llm_usage(operation, session_id, estimated_tokens, response)
+    return response
+
+def get_gemini_response(prompt, cached_content=None, model=None):
     print(f"Sending prompt to Gemini: {prompt[:200]}...") # Log first 200 chars of prompt
     headers = {"Content-Type": "application/json"}
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    data = build_gemini_request(prompt, cached_content)
+    model = model or GEMINI_MODEL_TIERS["standard"]
+    started = time.monotonic()
 
     print("Attempting to make Gemini API request...")
     try:
         # Use a tuple for timeout: (connect_timeout, read_timeout)
         # This ensures both connection establishment and data reading have timeouts
         response = requests.post(
-            GEMINI_API_URL, 
+            model_router.url_for(model), 
             headers=headers, 
             json=data, 
             timeout=(10, 60),  # 10 seconds to connect, 60 seconds to read response
@@ -450,13 +1196,14 @@ def get_gemini_response(prompt):
         print("Gemini API request completed.")
     except requests.exceptions.Timeout as e:
         print(f"Gemini API request timed out: {e}")
-        return {"error": "Gemini API request timed out. Please try again."}
+        return {"error": "Gemini API request timed out. Please try again.", "latency_ms": elapsed_ms(started), "model": model}
     except requests.exceptions.ConnectionError as e:
         print(f"Gemini API connection error: {e}")
-        return {"error": "Failed to connect to Gemini API. Please check your connection."}
+        return {"error": "Failed to connect to Gemini API. Please check your connection.", "latency_ms": elapsed_ms(started), "model": model}
     except requests.exceptions.RequestException as e:
         print(f"Gemini API request failed: {e}")
-        return {"error": f"Gemini API request failed: {e}"}
+        return {"error": f"Gemini API request failed: {e}", "latency_ms": elapsed_ms(started), "model": model}
+    latency_ms = elapsed_ms(started)
 
     print(f"Raw Gemini API response status: {response.status_code}")
     print(f"Raw Gemini API response body: {response.text[:500]}...") # Log first 500 chars of response
@@ -468,48 +1215,280 @@ def get_gemini_response(prompt):
             text_content = json_response["candidates"][0]["content"]["parts"][0]["text"]
             print(f"Parsed Gemini response text: {text_content[:200]}...")
             print("Successfully parsed Gemini response.")
-            return {"text": text_content}
+            return {"text": text_content, "usage": extract_usage(json_response), "latency_ms": latency_ms, "model": model}
         except json.JSONDecodeError:
             print(f"Gemini response is not JSON. Returning raw text as error.")
             print(f"Raw Gemini API response: {response.text}")
-            return {"error": "Gemini response was not valid JSON", "raw_response": response.text}
+            return {"error": "Gemini response was not valid JSON", "raw_response": response.text, "latency_ms": latency_ms, "model": model}
         except (KeyError, IndexError) as e:
             print(f"Error parsing Gemini response: {e}")
             print(f"Raw Gemini API response: {response.text}")
-            return {"error": f"Error parsing Gemini response: {e}", "raw_response": response.text}
+            return {"error": f"Error parsing Gemini response: {e}", "raw_response": response.text, "latency_ms": latency_ms, "model": model}
     else:
         print(f"Gemini API Error: Status Code {response.status_code}")
         print(f"Response Body: {response.text}")
-        return {"error": f"Gemini API Error: Status Code {response.status_code}", "response_body": response.text}
+        return {"error": f"Gemini API Error: Status Code {response.status_code}", "response_body": response.text, "latency_ms": latency_ms, "model": model}
+
+def elapsed_ms(started):
+    return int((time.monotonic() - started) * 1000)
+
+# Summary prompts are cut HEAD_TAIL to this budget, so that much of a document's
+# head and tail is all an upload needs to keep in memory for its summary.
+SUMMARY_SAMPLE_CHARS = PROMPT_TOKEN_BUDGETS.get("summarize_upload", 100000) * 4
+# Pages read to title a session from its first document.
+TITLE_PAGES = 3
+
+def write_document_pages(file_id, pages, sample=None):
+    """Insert a document's (page_number, text) pairs in batches, feeding each page to `sample` if given.
+
+    Returns the number of pages written. The caller commits.
+    """
+    batch = []
+    count = 0
+    for page_number, text in pages:
+        batch.append({"file_id": file_id, "page_number": page_number, "content": text})
+        if sample is not None:
+            sample.add(text + "\n")
+        count += 1
+        if len(batch) >= DOCUMENT_PAGE_WRITE_BATCH:
+            db.session.execute(DocumentPage.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(DocumentPage.__table__.insert(), batch)
+    return count
+
+def filter_document_pages(query, file_ids, page_ranges=None):
+    query = query.filter(DocumentPage.file_id.in_(file_ids))
+    if page_ranges:
+        query = query.filter(or_(*[DocumentPage.page_number.between(start, end) for start, end in page_ranges]))
+    return query
+
+def document_page_query(file_ids, page_ranges=None, char_limits=None):
+    """Pages of `file_ids` in order. With `char_limits` (file id -> characters),
+    a file's pages stop at the one that takes its text past its limit."""
+    columns = (DocumentPage.file_id, DocumentPage.page_number, DocumentPage.content)
+    if char_limits is None:
+        query = filter_document_pages(db.session.query(*columns), file_ids, page_ranges)
+        return query.order_by(DocumentPage.file_id, DocumentPage.page_number)
+
+    chars_before = func.sum(func.length(DocumentPage.content)).over(
+        partition_by=DocumentPage.file_id, order_by=DocumentPage.page_number,
+    ) - func.length(DocumentPage.content)
+    pages = filter_document_pages(db.session.query(*columns, chars_before.label("chars_before")), file_ids, page_ranges).subquery()
+    return (
+        db.session.query(pages.c.file_id, pages.c.page_number, pages.c.content)
+        .filter(pages.c.chars_before < case(char_limits, value=pages.c.file_id, else_=0))
+        .order_by(pages.c.file_id, pages.c.page_number)
+    )
 
-def generate_notes_from_text(document_text, style="concise"):
-    notes_prompt = f"""Generate structured, concise study notes in Markdown format from the following document.
+def iter_file_pages(file, page_ranges=None):
+    """Yield (page_number, text) for a document, optionally limited to `page_ranges`.
+
+    Documents uploaded before page storage are treated as a single page 1.
+    Pages are fetched DOCUMENT_PAGE_READ_BATCH at a time and each batch is
+    read in full, so no cursor stays open while the caller works through
+    them: on SQLite an open cursor holds a lock that stops other requests
+    from committing (e.g. for the whole of indexing a long document).
+    """
+    if file.full_text_content is not None:
+        if in_page_ranges(1, page_ranges):
+            yield 1, file.full_text_content
+        return
+    last_page = 0
+    while True:
+        rows = (
+            document_page_query([file.id], page_ranges)
+            .filter(DocumentPage.page_number > last_page)
+            .limit(DOCUMENT_PAGE_READ_BATCH)
+            .all()
+        )
+        for row in rows:
+            yield row.page_number, row.content
+        if len(rows) < DOCUMENT_PAGE_READ_BATCH:
+            return
+        last_page = rows[-1].page_number
+
+def document_texts(files, page_ranges=None, max_chars=None):
+    """Map file id -> text (of just `page_ranges`, if given) for the files with any text in range.
+
+    With `max_chars`, each file is read only as far as its share of that many
+    characters, shared out the way assemble_prompt shares its budget, so a
+    prompt built from the texts within that budget comes out the same.
+    """
+    texts = {}
+    for f in files:
+        if f.full_text_content and in_page_ranges(1, page_ranges):
+            texts[f.id] = f.full_text_content
+    paged_ids = [f.id for f in files if f.full_text_content is None]
+    char_limits = None
+    if paged_ids and max_chars is not None:
+        sizes = document_char_counts(paged_ids, page_ranges)
+        # Files without pages in range have nothing to read.
+        paged_ids = list(sizes)
+        sizes.update((file_id, len(text)) for file_id, text in texts.items())
+        char_limits = dict(zip(sizes, share_budget(list(sizes.values()), max_chars)))
+    if paged_ids:
+        pages = {}
+        for row in document_page_query(paged_ids, page_ranges, char_limits).yield_per(DOCUMENT_PAGE_READ_BATCH):
+            pages.setdefault(row.file_id, []).append(row.content)
+        for file_id, contents in pages.items():
+            text = "\n".join(contents)
+            if text.strip():
+                texts[file_id] = text
+    return texts
+
+def document_char_counts(file_ids, page_ranges=None):
+    """Map file id -> characters in its pages (just `page_ranges`, if given)."""
+    query = db.session.query(DocumentPage.file_id, func.sum(func.length(DocumentPage.content)))
+    return dict(filter_document_pages(query, file_ids, page_ranges).group_by(DocumentPage.file_id).all())
+
+def prompt_chars(operation):
+    """Characters of document text that can make it into an `operation` prompt (about four per token)."""
+    return PROMPT_TOKEN_BUDGETS[operation] * 4
+
+def document_page_counts(files):
+    counts = {f.id: 1 for f in files if f.full_text_content is not None}
+    paged_ids = [f.id for f in files if f.full_text_content is None]
+    if paged_ids:
+        counts.update(
+            db.session.query(DocumentPage.file_id, func.count(DocumentPage.id))
+            .filter(DocumentPage.file_id.in_(paged_ids))
+            .group_by(DocumentPage.file_id)
+            .all()
+        )
+    return counts
+
+def document_selection(data):
+    """Read the optional "file_id" and "pages" (e.g. "1-5,9") fields of a request. Raises ValueError."""
+    file_id = data.get("file_id")
+    if file_id is not None:
+        try:
+            file_id = int(file_id)
+        except (TypeError, ValueError):
+            raise ValueError("file_id must be an integer")
+    pages = data.get("pages")
+    page_ranges = parse_page_ranges(pages) if pages not in (None, "") else None
+    return file_id, page_ranges
+
+def session_files(session_id, file_id=None):
+    """The session's uploaded files in upload order, or just `file_id` if given."""
+    query = UploadedFile.query.filter_by(session_id=session_id)
+    if file_id is not None:
+        query = query.filter_by(id=file_id)
+    return query.order_by(UploadedFile.id).all()
+
+def index_document(session_id, file):
+    """Add a document's chunks to the session's vector index. Failures only cost retrieval quality."""
+    from vector_index import EmbeddingError
+    try:
+        count = get_vector_store().add_document(session_id, file.id, iter_file_pages(file))
+        print(f"Indexed {count} chunks for file {file.id} in session {session_id}")
+    except EmbeddingError as e:
+        print(f"Failed to index file {file.id} for session {session_id}: {e}")
+
+def retrieve_passages(session_id, files, query, k=VECTOR_TOP_K):
+    """Return the k document chunks most relevant to `query`, best first.
+
+    Files missing from the index (e.g. uploaded before it existed) are indexed
+    first. Returns None if retrieval isn't possible, so callers can fall back
+    to the full documents.
+    """
+    from vector_index import EmbeddingError
+    for file_id in get_vector_store().missing_documents(session_id, [f.id for f in files]):
+        index_document(session_id, next(f for f in files if f.id == file_id))
+
+    try:
+        hits = get_vector_store().search(session_id, [query], k)[0]
+    except EmbeddingError as e:
+        print(f"Retrieval failed for session {session_id}: {e}")
+        return None
+    filenames = {f.id: f.filename for f in files}
+    hits = [hit for hit in hits if hit[1] in filenames]
+    if not hits:
+        return None
+
+    return [
+        f"[From {filenames.get(file_id, 'document')}{f', page {page}' if page else ''}]\n{text}"
+        for _, file_id, page, text in hits
+    ]
+
+def session_documents(session, operation, custom_text=None, topic=None, file_id=None, page_ranges=None):
+    """Document texts for an `operation` prompt: custom text if given, else the
+    passages relevant to `topic` if given, else the session's documents (read
+    only as far as the operation's prompt budget).
+
+    `file_id` and `page_ranges` narrow the documents to one file and/or some pages.
+    """
+    if custom_text:
+        return [custom_text]
+    files = session_files(session.id, file_id)
+    if topic and not page_ranges:
+        passages = retrieve_passages(session.id, files, topic)
+        if passages:
+            return passages
+    texts = document_texts(files, page_ranges, prompt_chars(operation))
+    return [texts[f.id] for f in files if f.id in texts]
+
+def build_notes_prompt(documents, style="concise"):
+    return build_prompt(
+        "notes",
+        system=f"""Generate structured, concise study notes in Markdown format from the following document.
 The notes should be well-organized with headings, bullet points, and key terms.
-The style should be {style}.
+The style should be {style}.""",
+        documents=documents,
+        document_header="Document:",
+    )
+
+def build_notes_title_prompt(notes_text, document_text=None):
+    documents = [f"Notes:\n{notes_text}"]
+    if document_text:
+        # Streaming callers only have the opening of the notes, so give the
+        # model the start of the source document as well.
+        documents.append(f"Source document:\n{document_text}")
+    return build_prompt(
+        "notes_title",
+        system="Generate a short, concise title (5-10 words) for the following study notes. The title should capture the main subject of the notes. Respond with only the title and nothing else.",
+        documents=documents,
+    )
 
-Document:
-{document_text}
-"""
-    notes_response = get_gemini_response(notes_prompt)
+def parse_generated_title(title_response, default="Untitled Notes"):
+    if "text" in title_response and title_response["text"].strip():
+        return title_response["text"].strip().strip('"')
+    return default
+
+def generate_notes_from_text(documents, style="concise", session_id=None):
+    notes_response = call_gemini("notes", build_notes_prompt(documents, style), session_id=session_id)
 
     if "error" in notes_response:
         return notes_response # Propagate error
 
     markdown_content = notes_response["text"]
 
-    title_prompt = f"""Generate a short, concise title (5-10 words) for the following study notes. The title should capture the main subject of the notes. Respond with only the title and nothing else.
+    title_response = call_gemini("notes_title", build_notes_title_prompt(markdown_content), session_id=session_id)
+    generated_title = parse_generated_title(title_response)
 
-Notes:
-{markdown_content[:2000]}"""
-    title_response = get_gemini_response(title_prompt)
+    return {"text": markdown_content, "title": generated_title}
 
-    generated_title = "Untitled Notes"
-    if "text" in title_response:
-        generated_title = title_response["text"].strip().strip('"')
+def save_session_note(session_id, style, title, markdown_content):
+    """Render the notes to PDF and persist them. Raises if PDF conversion fails."""
+    pdf_filename = f"session_notes_{session_id}_{style}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+    pdf_path = os.path.join(current_app.config['UPLOAD_FOLDER'], pdf_filename)
+    markdown_to_pdf(markdown_content, pdf_path)
 
-    return {"text": markdown_content, "title": generated_title}
+    new_session_note = SessionNote(
+        session_id=session_id,
+        title=title,
+        markdown_content=markdown_content,
+        pdf_path=pdf_path
+    )
+    db.session.add(new_session_note)
+    db.session.commit()
+    return new_session_note
 
 def markdown_to_pdf(markdown_content, output_path):
+    from markdown import markdown
+    from weasyprint import HTML, CSS
+
     html_content = markdown(markdown_content)
     
     # Basic CSS for a clean, readable layout
@@ -524,16 +1503,7 @@ def markdown_to_pdf(markdown_content, output_path):
     HTML(string=html_content).write_pdf(output_path, stylesheets=[css])
     return output_path
 
-def filter_notes_section(text):
-    # This is a placeholder. The actual regex might need to be more sophisticated
-    # based on how "notes section" appears in the PDFs.
-    # Example: Remove text between "Notes" and the end of the document or next major heading.
-    # For now, a simple removal of lines starting with "Note" or "Notes"
-    lines = text.split('\n')
-    filtered_lines = [line for line in lines if not re.match(r'^(Note|Notes)[:\s].*', line, re.IGNORECASE)]
-    return '\n'.join(filtered_lines)
-
-@app.route("/sessions/<int:session_id>/messages", methods=["POST"])
+@bp.route("/sessions/<int:session_id>/messages", methods=["POST"])
 @login_required
 def save_message(session_id):
     session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
@@ -549,8 +1519,9 @@ def save_message(session_id):
     db.session.commit()
     return jsonify({"message": "Message saved", "id": new_message.id}), 201
 
-@app.route("/upload", methods=["POST"])
+@bp.route("/upload", methods=["POST"])
 @login_required
+@llm_admission(BATCH)
 def upload_file():
     session_id = request.form.get('session_id')
     if not session_id:
@@ -567,58 +1538,196 @@ def upload_file():
         filename = secure_filename(file.filename)
         print(f"Received file: {filename}")
         # Temporarily save file to process, then delete
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        temp_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(temp_filepath)
         print(f"File temporarily saved to: {temp_filepath}")
 
-        text = ""
-        if filename.lower().endswith('.pdf'):
-            with pdfplumber.open(temp_filepath) as pdf:
-                text = '\n'.join(page.extract_text() for page in pdf.pages)
-            print(f"Extracted text from PDF. Length: {len(text)}")
-        else:
-            with open(temp_filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                text = f.read()
-            print(f"Extracted text from non-PDF file. Length: {len(text)}")
-
-        os.remove(temp_filepath) # Clean up temporary file
-        print(f"Temporary file removed: {temp_filepath}")
-
+        # Pages stream from the extractor through the filters into the database,
+        # so only a batch of pages (plus the summary sample) is in memory at once.
+        new_uploaded_file = UploadedFile(session_id=session.id, filename=filename)
+        db.session.add(new_uploaded_file)
+        sample = HeadTailSample(SUMMARY_SAMPLE_CHARS)
         try:
-            print(f"Original text length before filtering: {len(text)}")
-            filtered_text = filter_notes_section(text)
-            print(f"Filtered text length: {len(filtered_text)}")
+            db.session.flush()
+            page_count = write_document_pages(new_uploaded_file.id, iter_filtered_pages(temp_filepath, filename), sample)
+            db.session.commit()
         except Exception as e:
-            print(f"Error filtering notes section: {e}")
+            db.session.rollback()
+            print(f"Error processing document {filename}: {e}")
             return jsonify({"message": "Error processing document", "details": str(e)}), 500
+        finally:
+            os.remove(temp_filepath) # Clean up temporary file
+            print(f"Temporary file removed: {temp_filepath}")
+        print(f"Extracted {page_count} pages from {filename}")
 
-        summarization_prompt = f"""Provide a detailed summary of the following text. The summary should be a single paragraph, approximately 3 to 5 sentences long, capturing the main ideas and key points.
-
-Text:
-{filtered_text}
-"""
-        print(f"Summarization prompt sent to Gemini (first 500 chars): {summarization_prompt[:500]}...")
-        print(f"Full summarization prompt length for upload_file: {len(summarization_prompt)}")
-        summary_response = get_gemini_response(summarization_prompt)
+        summarization_prompt = build_summary_prompt(sample.text())
+        print(f"Summarization prompt sent to Gemini (first 500 chars): {summarization_prompt.text[:500]}...")
+        print(f"Estimated summarization prompt tokens for upload_file: {summarization_prompt.estimated_tokens}")
+        summary_response = call_gemini("summarize_upload", summarization_prompt, session_id=session.id)
 
         print(f"Summary response from get_gemini_response: {summary_response}")
 
         if "error" in summary_response:
+            db.session.delete(new_uploaded_file)
+            db.session.commit()
             return jsonify({"message": "Error generating summary", "details": summary_response["error"]}), 500
 
         summary_text = summary_response["text"]
-
-        # Save file metadata to database
-        new_uploaded_file = UploadedFile(
-            session_id=session.id,
-            filename=filename,
-            summary=summary_text,
-            full_text_content=filtered_text
-        )
-        db.session.add(new_uploaded_file)
+        new_uploaded_file.summary = summary_text
         db.session.commit()
+        session_context_cache.invalidate(session.id)
+        index_document(session.id, new_uploaded_file)
+
+        return jsonify({
+            "summary": summary_text,
+            "file_id": new_uploaded_file.id,
+            "page_count": page_count,
+        })
+
+def build_summary_prompt(text):
+    return build_prompt(
+        "summarize_upload",
+        system="Provide a detailed summary of the following text. The summary should be a single paragraph, approximately 3 to 5 sentences long, capturing the main ideas and key points.",
+        documents=[text],
+        document_header="Text:",
+        document_policy=HEAD_TAIL,
+    )
+
+@bp.route("/upload/batch", methods=["POST"])
+@login_required
+def upload_files_batch():
+    """Upload many files in one multipart request (field name ``files``).
+
+    Files are extracted concurrently (each worker writes its pages to a
+    spool file), all rows and pages are written in one transaction, and
+    summaries run with bounded parallelism. Progress streams back as
+    newline-delimited JSON: ``extracted``/``error`` per file as extraction
+    finishes, ``saved`` once the rows exist, ``file`` (or ``error``) per
+    summary as it completes, then ``done``.
+
+    Each summary is admitted as batch work on its own, costing a token and
+    holding a slot while it runs, the same as a single /upload. When the
+    user's budget or the batch lane is exhausted the stream sends
+    ``waiting`` with ``retry_after`` and resumes once admitted.
+    """
+    session_id = request.form.get('session_id')
+    if not session_id:
+        return jsonify({"message": "Session ID is required"}), 400
+
+    session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
 
-        return jsonify({"summary": summary_text, "fullText": filtered_text, "file_id": new_uploaded_file.id})
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({"message": "No files selected"}), 400
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        return jsonify({"message": f"Too many files (max {UPLOAD_BATCH_MAX_FILES} per batch)"}), 400
+
+    # Save everything up front: the request body can't be read once the response starts streaming.
+    uploads = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        temp_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
+        file.save(temp_filepath)
+        uploads.append((filename, temp_filepath))
+    print(f"Received batch of {len(uploads)} files for session {session.id}")
+
+    # The ORM objects aren't usable once the view has returned and the body is streaming.
+    session_id = session.id
+    user_id = current_user.id
+
+    def event(payload):
+        return json.dumps(payload) + "\n"
+
+    def summarize(text):
+        prompt = build_summary_prompt(text)
+        return prompt, get_gemini_response(prompt.text, model=model_router.model_for("summarize_upload"))
+
+    def generate():
+        extracted = []
+        failed = 0
+        try:
+            futures = {}
+            for filename, path in uploads:
+                try:
+                    future, executor = submit_extraction(path, filename, f"{path}.pages", SUMMARY_SAMPLE_CHARS)
+                except BrokenProcessPool as e:
+                    failed += 1
+                    yield event({"type": "error", "filename": filename, "message": "Error processing document", "details": str(e)})
+                    continue
+                futures[future] = (filename, path, executor)
+            for future in as_completed(futures):
+                filename, path, executor = futures[future]
+                try:
+                    page_count, sample = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        # A worker died, taking every file still in the pool down with it.
+                        discard_extraction_executor(executor)
+                    failed += 1
+                    yield event({"type": "error", "filename": filename, "message": "Error processing document", "details": str(e)})
+                    continue
+                extracted.append((filename, f"{path}.pages", page_count, sample))
+                yield event({"type": "extracted", "filename": filename, "pages": page_count})
+
+            if not extracted:
+                yield event({"type": "done", "uploaded": 0, "failed": failed})
+                return
+
+            rows = [UploadedFile(session_id=session_id, filename=filename) for filename, _, _, _ in extracted]
+            db.session.add_all(rows)
+            db.session.flush()
+            for row, (_, pages_path, _, _) in zip(rows, extracted):
+                write_document_pages(row.id, read_pages_file(pages_path))
+            db.session.commit()
+        finally:
+            for _, path in uploads:
+                for spool_path in (path, f"{path}.pages"):
+                    if os.path.exists(spool_path):
+                        os.remove(spool_path)
+        session_context_cache.invalidate(session_id)
+        pending_rows = [(row.id, row.filename, page_count, sample) for row, (_, _, page_count, sample) in zip(rows, extracted)]
+        yield event({"type": "saved", "files": [{"file_id": file_id, "filename": filename} for file_id, filename, _, _ in pending_rows]})
+
+        # Keep at most UPLOAD_SUMMARY_CONCURRENCY summaries in flight, each admitted on its own.
+        in_flight = {}
+        queue = list(pending_rows)
+        retry_after = 1
+        while queue or in_flight:
+            while queue and len(in_flight) < UPLOAD_SUMMARY_CONCURRENCY:
+                try:
+                    ticket = admission.acquire(user_id, BATCH)
+                except AdmissionRejected as e:
+                    retry_after = e.retry_after
+                    break
+                file_id, filename, page_count, sample = queue.pop(0)
+                future = upload_summary_executor.submit(summarize, sample)
+                # Released when the call finishes, even if the client has gone away by then.
+                future.add_done_callback(lambda _, ticket=ticket: ticket.release())
+                in_flight[future] = (file_id, filename, page_count)
+            if not in_flight:
+                yield event({"type": "waiting", "retry_after": retry_after})
+                time.sleep(retry_after)
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_id, filename, page_count = in_flight.pop(future)
+                prompt, summary_response = future.result()
+                record_llm_usage("summarize_upload", session_id, prompt.estimated_tokens, summary_response, user_id=user_id)
+                if "error" in summary_response:
+                    failed += 1
+                    yield event({"type": "error", "file_id": file_id, "filename": filename, "message": "Error generating summary", "details": summary_response["error"]})
+                    continue
+
+                summary_text = summary_response["text"]
+                uploaded_file = db.session.get(UploadedFile, file_id)
+                uploaded_file.summary = summary_text
+                db.session.commit()
+                index_document(session_id, uploaded_file)
+                yield event({"type": "file", "file_id": file_id, "filename": filename, "summary": summary_text, "page_count": page_count})
+
+        yield event({"type": "done", "uploaded": len(pending_rows), "failed": failed})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 def parse_text_to_list(text):
     lines = text.split('\n')
@@ -633,12 +1742,29 @@ def parse_text_to_list(text):
             parsed_list.append(line)
     return parsed_list if parsed_list else [text] # Return original text as single item if no list format found
 
-def get_gemini_streaming_response(prompt):
+class GeminiStreamError(str):
+    """An error message yielded in place of text by get_gemini_streaming_response.
+
+    It is still a plain string, so callers that forward chunks verbatim (like
+    chat) keep working; callers that need to tell errors apart can isinstance-check.
+    """
+
+def get_gemini_streaming_response(prompt, cached_content=None, usage=None, model=None):
+    """Yield text chunks from Gemini as they arrive.
+
+    If a `usage` dict is passed, it is filled in with the token usage, total
+    latency and time to first token once the stream ends.
+    """
     print(f"--- FULL PROMPT SENT TO GEMINI ---\n{prompt}\n----------------------------------")
+    if usage is None:
+        usage = {}
+    model = model or GEMINI_MODEL_TIERS["standard"]
+    usage["model"] = model
+    started = time.monotonic()
     headers = {"Content-Type": "application/json"}
     # The Gemini API supports streaming via a different endpoint
-    streaming_url = GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent")
-    data = {"contents": [{"parts": [{"text": prompt}]}]}
+    streaming_url = model_router.url_for(model, streaming=True)
+    data = build_gemini_request(prompt, cached_content)
 
     try:
         response = requests.post(
@@ -655,7 +1781,8 @@ def get_gemini_streaming_response(prompt):
         if response.status_code != 200:
             error_body = response.text
             print(f"Gemini streaming error body: {error_body}")
-            yield f"Error: Gemini API returned status code {response.status_code}. {error_body}"
+            usage.update({"error": error_body, "latency_ms": elapsed_ms(started)})
+            yield GeminiStreamError(f"Error: Gemini API returned status code {response.status_code}. {error_body}")
             return
 
         # Use JSONDecoder.raw_decode for robust streaming JSON parsing
@@ -674,6 +1801,9 @@ def get_gemini_streaming_response(prompt):
                         # raw_decode finds the first valid JSON object in the buffer
                         obj, index = decoder.raw_decode(buffer)
                         
+                        if "usageMetadata" in obj:
+                            usage["usage"] = extract_usage(obj)
+
                         # Extract text if present
                         if "candidates" in obj and obj["candidates"]:
                             candidate = obj["candidates"][0]
@@ -681,6 +1811,7 @@ def get_gemini_streaming_response(prompt):
                                 text_part = candidate["content"]["parts"][0].get("text", "")
                                 if text_part:
                                     # print(f"Yielding text: {text_part}")
+                                    usage.setdefault("first_token_ms", elapsed_ms(started))
                                     yield text_part
                         
                         # Move the buffer past the parsed object and clean it
@@ -689,13 +1820,16 @@ def get_gemini_streaming_response(prompt):
                         # Incomplete JSON object, wait for more chunks
                         break
 
+        usage["latency_ms"] = elapsed_ms(started)
 
     except Exception as e:
         print(f"Streaming error: {e}")
-        yield f"Error: {str(e)}"
+        usage.update({"error": str(e), "latency_ms": elapsed_ms(started)})
+        yield GeminiStreamError(f"Error: {str(e)}")
 
-@app.route("/gemini_completion", methods=["POST"])
+@bp.route("/gemini_completion", methods=["POST"])
 @login_required
+@llm_admission(INTERACTIVE)
 def gemini_completion():
     data = request.json
     user_message_text = data.get("message", "")
@@ -711,23 +1845,52 @@ def gemini_completion():
     
     if len(user_message_text) > 5000:
         return jsonify({"message": "Message too long (max 5000 characters)"}), 400
+
+    try:
+        file_id, page_ranges = document_selection(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     
-    uploaded_files = UploadedFile.query.filter_by(session_id=session.id).all()
-    pdf_content = "\n\n".join([f.full_text_content for f in uploaded_files if f.full_text_content])
+    uploaded_files = session_files(session.id, file_id)
+    document_text_by_id = document_texts(uploaded_files, page_ranges, prompt_chars("chat"))
     
     previous_messages = ChatMessage.query.filter_by(session_id=session.id).order_by(ChatMessage.timestamp.desc()).limit(20).all()
     previous_messages.reverse()
     
     system_prompt = "You are AurenLM, a tutor-like chatbot. Your goal is to help users understand their documents. Be helpful, insightful, and ask clarifying questions to guide the user's learning. Respond in a clear and educational manner."
-    conversation_parts = [system_prompt]
-    if pdf_content:
-        conversation_parts.append(f"Document Content:\n{pdf_content}")
-    for msg in previous_messages:
-        conversation_parts.append(f"{'User' if msg.sender == 'user' else 'AurenLM'}: {msg.content}")
-    conversation_parts.append(f"User: {user_message_text}")
-    conversation_parts.append("AurenLM:")
-    
-    full_prompt_text = "\n\n".join(conversation_parts)
+    chat_sections = dict(
+        system=system_prompt,
+        document_header="Document Content:",
+        history=[f"{'User' if msg.sender == 'user' else 'AurenLM'}: {msg.content}" for msg in previous_messages],
+        user=f"User: {user_message_text}",
+        suffix="AurenLM:",
+    )
+    prompt = build_prompt("chat", documents=[document_text_by_id[f.id] for f in uploaded_files if f.id in document_text_by_id], **chat_sections)
+    # A file or page selection is a one-off view of the documents: don't cache
+    # it (that would replace the session's bundle) or swap it for retrieved passages.
+    whole_documents = file_id is None and page_ranges is None
+
+    # When the documents don't fit, send the passages relevant to this message
+    # instead of an arbitrary truncation.
+    retrieved = False
+    if "documents" in prompt.truncated and whole_documents:
+        passages = retrieve_passages(session.id, uploaded_files, user_message_text)
+        if passages:
+            prompt = build_prompt("chat", documents=passages, **chat_sections)
+            retrieved = True
+
+    # Reuse the session's cached document bundle upstream instead of re-sending
+    # (and re-processing) the documents on every turn.
+    prompt_text, cached_content = prompt.text, None
+    if prompt.documents_text and not retrieved and whole_documents:
+        context = session_context_cache.get(session.id, model_router.model_for("chat"), system_prompt, [f.id for f in uploaded_files], prompt.documents_text)
+        if context is not None:
+            try:
+                prompt_text, cached_content = session_context_cache.render(context, prompt.turn_text)
+            except ContextCacheError as e:
+                print(f"Context cache unusable for session {session.id}: {e}")
+                session_context_cache.invalidate(session.id)
+    estimated_tokens = estimate_tokens(prompt_text)
     
     # Save user message
     user_message = ChatMessage(session_id=session.id, sender='user', content=user_message_text)
@@ -735,21 +1898,31 @@ def gemini_completion():
     db.session.commit()
 
     if stream:
+        # The ORM objects aren't usable once the view has returned and the body is streaming.
+        session_id = session.id
+        user_id = current_user.id
+
         def generate():
             full_response = []
-            for chunk in get_gemini_streaming_response(full_prompt_text):
+            usage = {}
+            for chunk in stream_chat_response(session_id, prompt_text, cached_content, prompt.text, usage):
                 full_response.append(chunk)
                 yield chunk
             
             # Save the full AI response after streaming finishes
             final_text = "".join(full_response)
-            gemini_message = ChatMessage(session_id=session.id, sender='gemini', content=final_text)
+            gemini_message = ChatMessage(session_id=session_id, sender='gemini', content=final_text)
             db.session.add(gemini_message)
             db.session.commit()
+            record_llm_usage("chat", session_id, estimated_tokens, usage, user_id=user_id)
 
         return Response(stream_with_context(generate()), mimetype='text/plain')
     else:
-        gemini_response = get_gemini_response(full_prompt_text)
+        gemini_response = call_gemini("chat", prompt, session_id=session.id, cached_content=cached_content, prompt_text=prompt_text)
+        if "error" in gemini_response and cached_content:
+            # The cached bundle may have expired upstream; drop it and go inline.
+            session_context_cache.invalidate(session.id)
+            gemini_response = call_gemini("chat", prompt, session_id=session.id)
         if "error" in gemini_response:
             return jsonify({"message": "Error getting completion", "details": gemini_response["error"]}), 500
         
@@ -759,8 +1932,24 @@ def gemini_completion():
         db.session.commit()
         return jsonify({"content": gemini_text})
 
-@app.route("/summarize_conversation", methods=["POST"])
+def stream_chat_response(session_id, prompt_text, cached_content, inline_prompt_text, usage):
+    """Stream a chat reply, falling back to the inline prompt if the cached bundle is rejected."""
+    model = model_router.model_for("chat")
+    chunks = get_gemini_streaming_response(prompt_text, cached_content=cached_content, usage=usage, model=model)
+    first_chunk = next(chunks, None)
+    if cached_content and isinstance(first_chunk, GeminiStreamError):
+        print(f"Cached content rejected for session {session_id}: {first_chunk}")
+        session_context_cache.invalidate(session_id)
+        usage.clear()
+        yield from get_gemini_streaming_response(inline_prompt_text, usage=usage, model=model)
+        return
+    if first_chunk is not None:
+        yield first_chunk
+    yield from chunks
+
+@bp.route("/summarize_conversation", methods=["POST"])
 @login_required
+@llm_admission(INTERACTIVE)
 def summarize_conversation():
     data = request.json
     conversation_history = data.get("conversation_history", "")
@@ -773,38 +1962,51 @@ def summarize_conversation():
     if not conversation_history:
         return jsonify({"message": "No conversation history provided"}), 400
 
-    summarization_prompt = f"""Summarize the following conversation history concisely, retaining all key information and context. The summary should be a single paragraph.
-
-Conversation History:
-{conversation_history}
-"""
-    summary_response = get_gemini_response(summarization_prompt)
+    summarization_prompt = build_prompt(
+        "summarize_conversation",
+        system="Summarize the following conversation history concisely, retaining all key information and context. The summary should be a single paragraph.",
+        documents=[conversation_history],
+        document_header="Conversation History:",
+        # The most recent exchanges matter most for continuing the chat.
+        document_policy=TAIL,
+    )
+    summary_response = call_gemini("summarize_conversation", summarization_prompt, session_id=session.id)
 
     if "error" in summary_response:
         return jsonify({"message": "Error summarizing conversation", "details": summary_response["error"]}), 500
     else:
         return jsonify({"summary": summary_response["text"]})
 
-@app.route("/generate-mindmap", methods=["POST"])
+@bp.route("/generate-mindmap", methods=["POST"])
 @login_required
+@llm_admission(BATCH)
 def generate_mindmap():
     data = request.json
-    full_text = data.get("fullText", "")
     session_id = data.get("session_id")
 
     if not session_id:
         return jsonify({"message": "Session ID is required"}), 400
     session = ChatSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
 
-    if not full_text:
-        return jsonify({"message": "No text provided for mind map generation"}), 400
+    try:
+        file_id, page_ranges = document_selection(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Without "fullText", the mind map covers the session's documents.
+    documents = session_documents(session, "mindmap", data.get("fullText"), data.get("topic"), file_id, page_ranges)
 
-    mindmap_prompt = f"""Generate a hierarchical mindmap from the following document. Your response MUST be a single JSON object, and ONLY the JSON object. The JSON object must have a 'title' key and a 'nodes' array. Each node in the 'nodes' array must have an 'id', a 'label', and a 'children' array. The 'children' array should contain nested nodes following the same structure. Ensure the JSON is perfectly formed and contains no other text or markdown outside of the JSON object.
+    if not documents:
+        return jsonify({"message": "No text provided for mind map generation"}), 400
 
-Document:
-{full_text[:1000]}"""
+    mindmap_prompt = build_prompt(
+        "mindmap",
+        system="Generate a hierarchical mindmap from the following document. Your response MUST be a single JSON object, and ONLY the JSON object. The JSON object must have a 'title' key and a 'nodes' array. Each node in the 'nodes' array must have an 'id', a 'label', and a 'children' array. The 'children' array should contain nested nodes following the same structure. Ensure the JSON is perfectly formed and contains no other text or markdown outside of the JSON object.",
+        documents=documents,
+        document_header="Document:",
+    )
 
-    mindmap_response = get_gemini_response(mindmap_prompt)
+    mindmap_response = call_gemini("mindmap", mindmap_prompt, session_id=session.id)
 
     if "error" in mindmap_response:
         return jsonify({"message": "Error generating mind map", "details": mindmap_response["error"]}), 500
@@ -837,17 +2039,19 @@ Document:
         print(f"Unexpected error in generate_mindmap: {e}")
         return jsonify({"message": str(e)}), 500
 
-def generate_quiz_from_text(document_text, difficulty):
-    quiz_prompt = f"""Generate a multiple-choice quiz from the following document. The quiz should have between 5 and 10 questions. The difficulty of the quiz should be '{difficulty}'.
+def generate_quiz_from_text(documents, difficulty, session_id=None):
+    quiz_prompt = build_prompt(
+        "quiz",
+        system=f"""Generate a multiple-choice quiz from the following document. The quiz should have between 5 and 10 questions. The difficulty of the quiz should be '{difficulty}'.
 Your response MUST be a single JSON object, and ONLY the JSON object.
 The JSON object must have a 'title' key and a 'questions' array.
 Each object in the 'questions' array must have a 'question' (string), 'options' (array of strings), and a 'correct_answer' (string).
-Ensure the JSON is perfectly formed and contains no other text or markdown outside of the JSON object.
-
-Document:
-{document_text[:4000]}"""
+Ensure the JSON is perfectly formed and contains no other text or markdown outside of the JSON object.""",
+        documents=documents,
+        document_header="Document:",
+    )
 
-    quiz_response = get_gemini_response(quiz_prompt)
+    quiz_response = call_gemini("quiz", quiz_prompt, session_id=session_id)
 
     if "error" in quiz_response:
         return None, quiz_response["error"]
@@ -870,27 +2074,28 @@ Document:
         print(f"Unexpected error in generate_quiz_from_text: {e}")
         return None, str(e)
 
-@app.route("/api/sessions/<int:session_id>/generate_quiz", methods=["POST"])
+@bp.route("/api/sessions/<int:session_id>/generate_quiz", methods=["POST"])
 @login_required
+@llm_admission(BATCH)
 def generate_quiz_for_session(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
+    session = get_owned_or_abort(ChatSession, session_id)
 
     data = request.json
     difficulty = data.get("difficulty", "Normal")
     custom_text = data.get("custom_text")
     custom_title = data.get("custom_title")
 
-    if custom_text:
-        all_docs_text = custom_text
-    else:
-        all_docs_text = "\n\n".join([f.full_text_content for f in session.files if f.full_text_content])
+    try:
+        file_id, page_ranges = document_selection(data)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    documents = session_documents(session, "quiz", custom_text, data.get("topic"), file_id, page_ranges)
 
-    if not all_docs_text:
+    if not documents:
         return jsonify({"message": "No document content available in this session to generate a quiz."}), 400
 
-    quiz_data, error = generate_quiz_from_text(all_docs_text, difficulty)
+    quiz_data, error = generate_quiz_from_text(documents, difficulty, session_id=session.id)
 
     if error:
         return jsonify({"message": error}), 500
@@ -914,63 +2119,256 @@ def generate_quiz_for_session(session_id):
         "generated_at": new_quiz.generated_at.isoformat()
     })
 
-@app.route("/api/sessions/<int:session_id>/quizzes", methods=["GET"])
+@bp.route("/api/sessions/<int:session_id>/quizzes", methods=["GET"])
 @login_required
 def get_quizzes_for_session(session_id):
-    session = ChatSession.query.get_or_404(session_id)
-    if session.user_id != current_user.id:
-        return jsonify({"message": "Unauthorized"}), 403
-
-    quizzes = Quiz.query.filter_by(session_id=session.id).order_by(Quiz.generated_at.desc()).all()
-    return jsonify([
-        {
-            "id": q.id,
-            "session_id": q.session_id,
-            "difficulty": q.difficulty,
-            "quiz_data": q.quiz_data,
-            "generated_at": q.generated_at.isoformat()
-        }
-        for q in quizzes
+    scope, version = session_cache_version_or_abort(session_id, "quizzes")
+
+    def build():
+        quizzes = Quiz.query.filter_by(session_id=session_id).order_by(Quiz.generated_at.desc()).all()
+        return [
+            {
+                "id": q.id,
+                "session_id": q.session_id,
+                "difficulty": q.difficulty,
+                "quiz_data": q.quiz_data,
+                "generated_at": q.generated_at.isoformat()
+            }
+            for q in quizzes
+        ]
+
+    return versioned_json(scope, version, build)
+
+def load_answer_keys(quiz_ids):
+    rows = (
+        db.session.query(Quiz.id, Quiz.session_id, Quiz.quiz_data, ChatSession.user_id)
+        .join(ChatSession, ChatSession.id == Quiz.session_id)
+        .filter(Quiz.id.in_(quiz_ids))
+        .all()
+    )
+    return [answer_key_from_quiz_data(r.id, r.session_id, r.user_id, r.quiz_data) for r in rows]
+
+def answer_keys_or_abort(quiz_ids):
+    """Answer keys for the given quizzes. Aborts with 404 if any is missing and 403 if any isn't the current user's."""
+    keys = quiz_answer_keys.get_many(quiz_ids, load_answer_keys)
+    missing = sorted(set(quiz_ids) - set(keys))
+    if missing:
+        abort(make_response(jsonify({"message": "Quiz not found", "quiz_ids": missing}), 404))
+    if any(key.owner_id != current_user.id for key in keys.values()):
+        abort(make_response(jsonify({"message": "Unauthorized"}), 403))
+    return keys
+
+def dialect_insert(table, dialect_name=None):
+    # Both dialects provide INSERT ... ON CONFLICT DO UPDATE with the same API.
+    if (dialect_name or db.engine.dialect.name) == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def record_quiz_attempts(user_id, graded_attempts):
+    """Store graded attempts and fold them into the aggregate tables. The caller commits."""
+    db.session.add_all([
+        QuizAttempt(quiz_id=a.quiz_id, user_id=user_id, answers=a.answers, score=a.score, attempted_at=a.attempted_at)
+        for a in graded_attempts
     ])
-
-@app.route("/api/quizzes/<int:quiz_id>/submit", methods=["POST"])
+    update_quiz_stats(user_id, graded_attempts)
+
+def update_quiz_stats(user_id, graded_attempts):
+    """Add graded attempts to the per-user and per-question aggregates with one upsert per table."""
+    user_stats, question_stats = aggregate(user_id, graded_attempts)
+
+    if user_stats:
+        table = UserQuizStat.__table__
+        stmt = dialect_insert(table)
+        new = stmt.excluded
+        newer = new.last_attempted_at >= table.c.last_attempted_at
+        stmt = stmt.on_conflict_do_update(index_elements=["user_id", "quiz_id"], set_={
+            "attempts": table.c.attempts + new.attempts,
+            "total_score": table.c.total_score + new.total_score,
+            "best_score": case((new.best_score > table.c.best_score, new.best_score), else_=table.c.best_score),
+            "last_score": case((newer, new.last_score), else_=table.c.last_score),
+            "last_attempted_at": case((newer, new.last_attempted_at), else_=table.c.last_attempted_at),
+            "questions_answered": table.c.questions_answered + new.questions_answered,
+            "questions_correct": table.c.questions_correct + new.questions_correct,
+        })
+        db.session.execute(stmt, list(user_stats.values()))
+
+    if question_stats:
+        table = QuizQuestionStat.__table__
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=["quiz_id", "question_index"], set_={
+            "attempts": table.c.attempts + stmt.excluded.attempts,
+            "correct": table.c.correct + stmt.excluded.correct,
+        })
+        db.session.execute(stmt, [
+            {"quiz_id": quiz_id, "question_index": index, "attempts": attempts, "correct": correct}
+            for (quiz_id, index), (attempts, correct) in question_stats.items()
+        ])
+
+def rebuild_quiz_stats(chunk_size=500):
+    """Recompute the quiz aggregates from every stored attempt."""
+    db.session.query(UserQuizStat).delete()
+    db.session.query(QuizQuestionStat).delete()
+    attempts = db.session.query(QuizAttempt.quiz_id, QuizAttempt.user_id, QuizAttempt.answers, QuizAttempt.attempted_at)
+    chunk = []
+    for attempt in attempts.yield_per(chunk_size):
+        chunk.append(attempt)
+        if len(chunk) >= chunk_size:
+            _aggregate_stored_attempts(chunk)
+            chunk = []
+    if chunk:
+        _aggregate_stored_attempts(chunk)
+    db.session.commit()
+    print("Rebuilt quiz statistics from stored attempts")
+
+def _aggregate_stored_attempts(attempts):
+    keys = {key.quiz_id: key for key in load_answer_keys({a.quiz_id for a in attempts})}
+    by_user = {}
+    for a in attempts:
+        if a.quiz_id in keys:
+            by_user.setdefault(a.user_id, []).append(grade(keys[a.quiz_id], a.answers or {}, a.attempted_at or datetime.utcnow()))
+    for user_id, graded in by_user.items():
+        update_quiz_stats(user_id, graded)
+
+def attempt_result(key, attempt):
+    return {
+        "quiz_id": key.quiz_id,
+        "score": attempt.score,
+        "correct_answers": attempt.correct_count,
+        "total_questions": len(key.answers),
+        "correct_answers_map": dict(enumerate(key.answers)),
+    }
+
+@bp.route("/api/quizzes/<int:quiz_id>/submit", methods=["POST"])
 @login_required
 def submit_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
+    key = answer_keys_or_abort([quiz_id])[quiz_id]
     data = request.json
     answers = data.get("answers")
 
     if not answers:
         return jsonify({"message": "No answers provided"}), 400
 
-    correct_answers = 0
-    total_questions = len(quiz.quiz_data['questions'])
+    attempt = grade(key, answers, datetime.utcnow())
+    record_quiz_attempts(current_user.id, [attempt])
+    db.session.commit()
 
-    for i, question in enumerate(quiz.quiz_data['questions']):
-        if str(i) in answers and answers[str(i)] == question['correct_answer']:
-            correct_answers += 1
+    result = attempt_result(key, attempt)
+    result["message"] = "Quiz submitted successfully"
+    return jsonify(result)
+
+def parse_attempted_at(value):
+    """Parse an offline attempt's ISO 8601 timestamp into naive UTC, capped at now."""
+    now = datetime.utcnow()
+    if value is None:
+        return now
+    attempted_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if attempted_at.tzinfo is not None:
+        attempted_at = attempted_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(attempted_at, now)
+
+@bp.route("/api/quizzes/submit_batch", methods=["POST"])
+@login_required
+def submit_quizzes_batch():
+    """Grade and store many attempts (e.g. taken offline) in one transaction.
+
+    Body: {"submissions": [{"quiz_id": 1, "answers": {"0": "..."}, "attempted_at": "2024-05-01T10:00:00Z"}, ...]}.
+    Either every submission is stored or none is.
+    """
+    data = request.json or {}
+    submissions = data.get("submissions")
+    if not isinstance(submissions, list) or not submissions:
+        return jsonify({"message": "No submissions provided"}), 400
+    if len(submissions) > QUIZ_BATCH_MAX_SUBMISSIONS:
+        return jsonify({"message": f"Too many submissions (max {QUIZ_BATCH_MAX_SUBMISSIONS} per batch)"}), 400
+
+    parsed = []
+    for i, submission in enumerate(submissions):
+        if not isinstance(submission, dict):
+            return jsonify({"message": f"Submission {i} must be an object"}), 400
+        answers = submission.get("answers")
+        if not answers or not isinstance(answers, dict):
+            return jsonify({"message": f"Submission {i} has no answers"}), 400
+        try:
+            quiz_id = int(submission.get("quiz_id"))
+            attempted_at = parse_attempted_at(submission.get("attempted_at"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"message": f"Submission {i} is invalid", "details": str(e)}), 400
+        parsed.append((quiz_id, answers, attempted_at))
+
+    keys = answer_keys_or_abort(list({quiz_id for quiz_id, _, _ in parsed}))
+    graded = [grade(keys[quiz_id], answers, attempted_at) for quiz_id, answers, attempted_at in parsed]
+    record_quiz_attempts(current_user.id, graded)
+    db.session.commit()
 
-    score = (correct_answers / total_questions) * 100 if total_questions > 0 else 0
+    return jsonify({
+        "message": f"{len(graded)} quiz attempts submitted successfully",
+        "results": [attempt_result(keys[a.quiz_id], a) for a in graded],
+    })
 
-    new_attempt = QuizAttempt(
-        quiz_id=quiz.id,
-        user_id=current_user.id,
-        answers=answers,
-        score=score
+@bp.route("/api/progress", methods=["GET"])
+@login_required
+def get_quiz_progress():
+    """The current user's quiz progress across sessions, read from the aggregates in one query."""
+    rows = (
+        db.session.query(UserQuizStat, ChatSession.title, Quiz.difficulty, Quiz.generated_at)
+        .join(ChatSession, ChatSession.id == UserQuizStat.session_id)
+        .join(Quiz, Quiz.id == UserQuizStat.quiz_id)
+        .filter(UserQuizStat.user_id == current_user.id)
+        .order_by(UserQuizStat.last_attempted_at.desc())
+        .all()
     )
-    db.session.add(new_attempt)
-    db.session.commit()
 
-    correct_answers_map = {i: q['correct_answer'] for i, q in enumerate(quiz.quiz_data['questions'])}
+    sessions = {}
+    totals = {"quizzes": 0, "attempts": 0, "questions_answered": 0, "questions_correct": 0, "best_score_sum": 0.0}
+    for stat, session_title, difficulty, generated_at in rows:
+        session = sessions.setdefault(stat.session_id, {
+            "session_id": stat.session_id,
+            "session_title": session_title,
+            "quizzes": [],
+        })
+        session["quizzes"].append({
+            "quiz_id": stat.quiz_id,
+            "difficulty": difficulty,
+            "generated_at": generated_at.isoformat() if generated_at else None,
+            "attempts": stat.attempts,
+            "best_score": stat.best_score,
+            "last_score": stat.last_score,
+            "average_score": stat.total_score / stat.attempts if stat.attempts else None,
+            "accuracy": stat.questions_correct / stat.questions_answered if stat.questions_answered else None,
+            "last_attempted_at": stat.last_attempted_at.isoformat() if stat.last_attempted_at else None,
+        })
+        totals["quizzes"] += 1
+        totals["attempts"] += stat.attempts
+        totals["questions_answered"] += stat.questions_answered
+        totals["questions_correct"] += stat.questions_correct
+        totals["best_score_sum"] += stat.best_score
 
     return jsonify({
-        "message": "Quiz submitted successfully",
-        "score": score,
-        "correct_answers": correct_answers,
-        "total_questions": total_questions,
-        "correct_answers_map": correct_answers_map
-    })
+        "quizzes_attempted": totals["quizzes"],
+        "attempts": totals["attempts"],
+        "accuracy": totals["questions_correct"] / totals["questions_answered"] if totals["questions_answered"] else None,
+        "average_best_score": totals["best_score_sum"] / totals["quizzes"] if totals["quizzes"] else None,
+        "sessions": list(sessions.values()),
+    }), 200
+
+@bp.route("/api/quizzes/<int:quiz_id>/stats", methods=["GET"])
+@login_required
+def get_quiz_question_stats(quiz_id):
+    """Per-question attempt counts and accuracy for a quiz, hardest first."""
+    key = answer_keys_or_abort([quiz_id])[quiz_id]
+    stats = QuizQuestionStat.query.filter_by(quiz_id=quiz_id).all()
+    questions = [
+        {"question_index": st.question_index, "attempts": st.attempts, "correct": st.correct,
+         "accuracy": st.correct / st.attempts if st.attempts else None}
+        for st in stats
+    ]
+    questions.sort(key=lambda q: (q["accuracy"] if q["accuracy"] is not None else 1.0, q["question_index"]))
+    return jsonify({"quiz_id": key.quiz_id, "total_questions": len(key.answers), "questions": questions}), 200
 
 
 if __name__ == "__main__":
+    app = create_app()
+    init_db(app)
     app.run(debug=True, port=5000)
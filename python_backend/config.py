@@ -1,15 +1,139 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Load variables from .env file
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-# Ensure the API key is set before formatting the URL
-if GEMINI_API_KEY:
-    GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
-else:
-    GEMINI_API_URL = None
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+if not GEMINI_API_KEY:
     print("Warning: GEMINI_API_KEY not found in environment variables.")
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your_secret_key_here")
+
+# App startup. "lazy" imports the PDF/markdown engines and numpy on first use;
+# "preload" imports them in create_app, for servers that load the app once and
+# fork workers from it (gunicorn.conf.py sets this). Schema creation runs at
+# startup only if AUTO_CREATE_SCHEMA is set; otherwise use `flask --app app init-db`
+# (`python app.py` always does it).
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+AUTO_CREATE_SCHEMA = os.getenv("AUTO_CREATE_SCHEMA", "false").lower() in ("1", "true", "yes")
+
+# How long the logged-in user is served from the per-process cache before it
+# is reloaded (changes made in the same process invalidate it immediately).
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Admission control for Gemini-bound endpoints.
+# Global number of LLM requests allowed in flight per process. The last
+# ADMISSION_INTERACTIVE_RESERVED slots can only be taken by interactive work
+# (chat), so batch jobs (notes, quizzes, mindmaps, uploads) can never starve it.
+ADMISSION_GLOBAL_CONCURRENCY = int(os.getenv("ADMISSION_GLOBAL_CONCURRENCY", "16"))
+ADMISSION_INTERACTIVE_RESERVED = int(os.getenv("ADMISSION_INTERACTIVE_RESERVED", "4"))
+# Per-user token buckets: sustained requests per minute and burst size. Each
+# uploaded file costs a batch token (the frontend uploads files one request at
+# a time), so the batch burst covers selecting a handful of files and then
+# generating a mindmap, quiz and notes. Requests rejected with a 4xx get their
+# token back.
+ADMISSION_INTERACTIVE_RATE = float(os.getenv("ADMISSION_INTERACTIVE_RATE", "30"))
+ADMISSION_INTERACTIVE_BURST = int(os.getenv("ADMISSION_INTERACTIVE_BURST", "10"))
+ADMISSION_BATCH_RATE = float(os.getenv("ADMISSION_BATCH_RATE", "20"))
+ADMISSION_BATCH_BURST = int(os.getenv("ADMISSION_BATCH_BURST", "20"))
+
+# Upstream context caching of session documents for chat.
+# "gemini" registers cachedContents with the API, "local" is an in-process
+# stand-in with the same protocol (for tests/offline use), "off" disables it.
+CONTEXT_CACHE_BACKEND = os.getenv("CONTEXT_CACHE_BACKEND", "gemini")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Gemini rejects caches below a minimum token count; smaller document sets are
+# sent inline.
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "2048"))
+
+# Per-operation prompt budgets, in estimated tokens. Override individual
+# entries with a JSON object in PROMPT_TOKEN_BUDGETS, e.g. '{"quiz": 20000}'.
+PROMPT_TOKEN_BUDGETS = {
+    "chat": 200000,
+    "summarize_upload": 100000,
+    "summarize_conversation": 30000,
+    "notes": 150000,
+    "notes_title": 1500,
+    "title": 1500,
+    "mindmap": 4000,
+    "quiz": 8000,
+}
+PROMPT_TOKEN_BUDGETS.update(json.loads(os.getenv("PROMPT_TOKEN_BUDGETS", "{}")))
+
+# Model routing. Each operation runs on a tier, and each tier maps to a model.
+# Override either map with a JSON object, e.g.
+# GEMINI_OPERATION_TIERS='{"quiz": "pro"}'.
+GEMINI_MODEL_TIERS = {
+    "lite": "gemini-2.5-flash-lite",
+    "standard": GEMINI_MODEL,
+    "pro": "gemini-2.5-pro",
+}
+GEMINI_MODEL_TIERS.update(json.loads(os.getenv("GEMINI_MODEL_TIERS", "{}")))
+GEMINI_OPERATION_TIERS = {
+    "title": "lite",
+    "notes_title": "lite",
+    "summarize_conversation": "lite",
+    "mindmap": "standard",
+    "quiz": "standard",
+    "notes": "standard",
+    "summarize_upload": "standard",
+    "chat": "standard",
+}
+GEMINI_OPERATION_TIERS.update(json.loads(os.getenv("GEMINI_OPERATION_TIERS", "{}")))
+
+# Hedged requests for latency-critical, non-streaming calls: if no answer
+# arrives within the operation's recent p<percentile> latency, a backup request
+# is fired and the first good answer wins. This costs extra requests for lower
+# tail latency. Until enough samples exist, default_delay_ms is used. Set to
+# '{}' to disable hedging entirely.
+GEMINI_HEDGING = {
+    "chat": {"percentile": 95, "default_delay_ms": 8000, "min_delay_ms": 1000},
+    "title": {"percentile": 95, "default_delay_ms": 3000, "min_delay_ms": 500},
+    "summarize_conversation": {"percentile": 95, "default_delay_ms": 5000, "min_delay_ms": 500},
+}
+_hedging_override = json.loads(os.getenv("GEMINI_HEDGING", "null"))
+if _hedging_override is not None:
+    GEMINI_HEDGING = _hedging_override
+
+# Semantic retrieval over document chunks. VECTOR_EMBEDDER is "gemini" (the
+# embedding API) or "hashing" (deterministic and offline, lexical only).
+VECTOR_EMBEDDER = os.getenv("VECTOR_EMBEDDER", "gemini")
+VECTOR_EMBEDDING_MODEL = os.getenv("VECTOR_EMBEDDING_MODEL", "text-embedding-004")
+VECTOR_STORE_FOLDER = os.getenv("VECTOR_STORE_FOLDER", "vector_store")
+VECTOR_CHUNK_CHARS = int(os.getenv("VECTOR_CHUNK_CHARS", "1500"))
+VECTOR_CHUNK_OVERLAP = int(os.getenv("VECTOR_CHUNK_OVERLAP", "200"))
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "12"))
+# Session indexes kept in memory per process (least recently used are dropped).
+VECTOR_INDEX_CACHE_SESSIONS = int(os.getenv("VECTOR_INDEX_CACHE_SESSIONS", "64"))
+
+# Document text is stored one row per page. Pages are written in batches of
+# DOCUMENT_PAGE_WRITE_BATCH and read back DOCUMENT_PAGE_READ_BATCH at a time.
+DOCUMENT_PAGE_WRITE_BATCH = int(os.getenv("DOCUMENT_PAGE_WRITE_BATCH", "200"))
+DOCUMENT_PAGE_READ_BATCH = int(os.getenv("DOCUMENT_PAGE_READ_BATCH", "200"))
+
+# Quiz grading: answer keys kept in memory per process, and the most
+# attempts accepted by one /api/quizzes/submit_batch request.
+QUIZ_ANSWER_KEY_CACHE_SIZE = int(os.getenv("QUIZ_ANSWER_KEY_CACHE_SIZE", "1024"))
+QUIZ_BATCH_MAX_SUBMISSIONS = int(os.getenv("QUIZ_BATCH_MAX_SUBMISSIONS", "100"))
+
+# Serialized bodies of the polled list endpoints (sessions, quizzes, notes)
+# kept in memory per process, by change-counter version.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# SQL instrumentation. Every request's statement count and time are logged
+# (at warning level past SQL_QUERY_WARN_THRESHOLD statements); with
+# SQL_METRICS_HEADERS set they are also returned in X-SQL-Queries and
+# X-SQL-Time-ms response headers.
+SQL_METRICS_HEADERS = os.getenv("SQL_METRICS_HEADERS", "false").lower() in ("1", "true", "yes")
+SQL_QUERY_WARN_THRESHOLD = int(os.getenv("SQL_QUERY_WARN_THRESHOLD", "25"))
+
+# Batch uploads (/upload/batch): at most this many files per request,
+# extracted in parallel worker processes and summarized with bounded
+# parallelism. Each summary costs a batch admission token, like an /upload.
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "50"))
+UPLOAD_EXTRACT_WORKERS = int(os.getenv("UPLOAD_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+UPLOAD_SUMMARY_CONCURRENCY = int(os.getenv("UPLOAD_SUMMARY_CONCURRENCY", "4"))
@@ -0,0 +1,191 @@
+import hashlib
+import itertools
+import threading
+import time
+
+import requests
+
+from prompt_budget import estimate_tokens
+
+
+class ContextCacheError(Exception):
+    pass
+
+
+class GeminiContextCacheBackend:
+    """Registers document prefixes with Gemini's cachedContents API."""
+
+    def __init__(self, api_base, api_key):
+        self.api_base = api_base
+        self.api_key = api_key
+
+    def create(self, model, system_instruction, document_text, ttl_seconds):
+        body = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"role": "user", "parts": [{"text": document_text}]}],
+            "ttl": f"{ttl_seconds}s",
+        }
+        try:
+            response = requests.post(
+                f"{self.api_base}/cachedContents?key={self.api_key}",
+                json=body,
+                timeout=(10, 60),
+            )
+        except requests.exceptions.RequestException as e:
+            raise ContextCacheError(f"Failed to create cached content: {e}")
+        if response.status_code != 200:
+            raise ContextCacheError(f"Failed to create cached content: {response.status_code} {response.text[:500]}")
+        return response.json()["name"]
+
+    def refresh(self, name, ttl_seconds):
+        try:
+            response = requests.patch(
+                f"{self.api_base}/{name}?updateMask=ttl&key={self.api_key}",
+                json={"ttl": f"{ttl_seconds}s"},
+                timeout=(10, 30),
+            )
+        except requests.exceptions.RequestException as e:
+            raise ContextCacheError(f"Failed to refresh cached content: {e}")
+        if response.status_code != 200:
+            raise ContextCacheError(f"Failed to refresh cached content: {response.status_code}")
+
+    def delete(self, name):
+        try:
+            requests.delete(f"{self.api_base}/{name}?key={self.api_key}", timeout=(10, 30))
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to delete cached content {name}: {e}")
+
+    def render(self, name, turn_text):
+        """Return (prompt, cached_content) to send for a turn using this cache."""
+        return turn_text, name
+
+
+class LocalContextCacheBackend:
+    """In-process stand-in for GeminiContextCacheBackend.
+
+    Follows the same create/refresh/delete/render protocol, but keeps the
+    cached prefix in memory and splices it back into the prompt, so the
+    bookkeeping can be exercised without the API. Unknown handles raise, just
+    like an expired cache does upstream.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._ids = itertools.count(1)
+
+    def create(self, model, system_instruction, document_text, ttl_seconds):
+        name = f"cachedContents/local-{next(self._ids)}"
+        self.entries[name] = {
+            "model": model,
+            "system_instruction": system_instruction,
+            "document_text": document_text,
+            "ttl_seconds": ttl_seconds,
+        }
+        return name
+
+    def refresh(self, name, ttl_seconds):
+        if name not in self.entries:
+            raise ContextCacheError(f"Unknown cached content: {name}")
+        self.entries[name]["ttl_seconds"] = ttl_seconds
+
+    def delete(self, name):
+        self.entries.pop(name, None)
+
+    def render(self, name, turn_text):
+        entry = self.entries.get(name)
+        if entry is None:
+            raise ContextCacheError(f"Unknown cached content: {name}")
+        prompt = "\n\n".join([entry["system_instruction"], entry["document_text"], turn_text])
+        return prompt, None
+
+
+class CachedContext:
+    def __init__(self, name, fingerprint, expires_at):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+
+class SessionContextCache:
+    """Tracks one cached document bundle per chat session.
+
+    A bundle is registered the first time a session with documents is chatted
+    with, reused by handle on later turns, refreshed before its TTL runs out,
+    and dropped when the session's documents change.
+    """
+
+    # Refresh this long before expiry so an in-flight turn never hits a dead handle.
+    REFRESH_MARGIN_SECONDS = 120
+    # After a failed registration, send documents inline for a while before retrying.
+    FAILURE_BACKOFF_SECONDS = 60
+
+    def __init__(self, backend, ttl_seconds, min_tokens):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(model, system_instruction, document_ids):
+        key = "|".join([model, system_instruction, ",".join(str(i) for i in sorted(document_ids))])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, session_id, model, system_instruction, document_ids, document_text):
+        """Return the CachedContext for this session's documents, registering it if needed.
+
+        Returns None when the documents are too small to cache or the backend
+        is unavailable; the caller should then send them inline.
+        """
+        if self.backend is None or estimate_tokens(document_text) < self.min_tokens:
+            return None
+
+        fingerprint = self.fingerprint(model, system_instruction, document_ids)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is not None and entry.fingerprint == fingerprint:
+            if entry.name is None:
+                return None if now < entry.expires_at else self._register(session_id, model, system_instruction, document_text, fingerprint)
+            if now < entry.expires_at - self.REFRESH_MARGIN_SECONDS:
+                return entry
+            try:
+                self.backend.refresh(entry.name, self.ttl_seconds)
+                entry.expires_at = now + self.ttl_seconds
+                return entry
+            except ContextCacheError as e:
+                print(f"Context cache refresh failed for session {session_id}: {e}")
+
+        return self._register(session_id, model, system_instruction, document_text, fingerprint)
+
+    def _register(self, session_id, model, system_instruction, document_text, fingerprint):
+        self.invalidate(session_id)
+        now = time.time()
+        try:
+            name = self.backend.create(model, system_instruction, document_text, self.ttl_seconds)
+        except ContextCacheError as e:
+            print(f"Context cache registration failed for session {session_id}: {e}")
+            with self._lock:
+                self._entries[session_id] = CachedContext(None, fingerprint, now + self.FAILURE_BACKOFF_SECONDS)
+            return None
+
+        entry = CachedContext(name, fingerprint, now + self.ttl_seconds)
+        with self._lock:
+            previous = self._entries.get(session_id)
+            self._entries[session_id] = entry
+        if previous is not None and previous.name:
+            # Lost a race with a concurrent registration for the same session.
+            self.backend.delete(previous.name)
+        return entry
+
+    def render(self, context, turn_text):
+        return self.backend.render(context.name, turn_text)
+
+    def invalidate(self, session_id):
+        """Forget (and delete upstream) the session's cached bundle, e.g. after its documents change."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is not None and entry.name:
+            self.backend.delete(entry.name)
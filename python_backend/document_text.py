@@ -0,0 +1,158 @@
+"""Text extraction for uploaded documents.
+
+Documents are processed a page at a time: pages are read lazily, passed
+through the filter stages and handed on as (page_number, text) pairs, so the
+whole document is never held in memory. Kept free of Flask and database
+imports so extraction can run in worker processes without importing the app.
+"""
+
+import json
+import re
+from collections import deque
+
+from prompt_budget import TRUNCATION_MARKER
+
+# Plain-text files have no pages; they are split at line ends into pages of about this size.
+TEXT_PAGE_CHARS = 4000
+
+# Lines starting with "Note"/"Notes" followed by ":" or whitespace (but not a line break).
+NOTES_LINE_RE = re.compile(r'^Notes?(?::|[^\S\n])[^\n]*(?:\n|\Z)', re.IGNORECASE | re.MULTILINE)
+BLANK_RUN_RE = re.compile(r'\n[^\S\n]*(?:\n[^\S\n]*){2,}')
+PAGE_RANGE_RE = re.compile(r'^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$')
+
+
+def drop_notes_lines(text):
+    # A simple stand-in for removing the "notes section": drops lines that
+    # start with "Note" or "Notes".
+    return NOTES_LINE_RE.sub('', text)
+
+
+def collapse_blank_runs(text):
+    return BLANK_RUN_RE.sub('\n\n', text)
+
+
+# Applied to every page, in order.
+FILTER_STAGES = (drop_notes_lines, collapse_blank_runs)
+
+
+def iter_document_pages(path, filename):
+    """Yield (page_number, text) for each page of a document, starting at 1."""
+    if filename.lower().endswith('.pdf'):
+        # Imported here so only processes that actually read PDFs load it.
+        import pdfplumber
+        with pdfplumber.open(path) as pdf:
+            for number, page in enumerate(pdf.pages, start=1):
+                text = page.extract_text() or ''
+                # Drop the page's parsed layout objects before moving on.
+                page.close()
+                yield number, text
+        return
+
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        number, lines, size = 1, [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_PAGE_CHARS:
+                yield number, ''.join(lines)
+                number, lines, size = number + 1, [], 0
+        if lines or number == 1:
+            yield number, ''.join(lines)
+
+
+def filter_pages(pages, stages=FILTER_STAGES):
+    for number, text in pages:
+        for stage in stages:
+            text = stage(text)
+        yield number, text
+
+
+def iter_filtered_pages(path, filename):
+    return filter_pages(iter_document_pages(path, filename))
+
+
+class HeadTailSample:
+    """Keeps the first and last `max_chars // 2` characters of a stream of text.
+
+    Builds a summary input from a document while its pages stream past,
+    cut the way HEAD_TAIL truncation would cut the full text.
+    """
+
+    def __init__(self, max_chars):
+        self.half = max(max_chars // 2, 1)
+        self.head = []
+        self.head_len = 0
+        self.tail = deque()
+        self.tail_len = 0
+        self.truncated = False
+
+    def add(self, text):
+        if self.head_len < self.half:
+            take = text[:self.half - self.head_len]
+            self.head.append(take)
+            self.head_len += len(take)
+            text = text[len(take):]
+        if not text:
+            return
+        self.tail.append(text)
+        self.tail_len += len(text)
+        while self.tail_len - len(self.tail[0]) >= self.half:
+            self.tail_len -= len(self.tail.popleft())
+            self.truncated = True
+
+    def text(self):
+        tail = ''.join(self.tail)
+        if len(tail) > self.half:
+            return ''.join(self.head) + TRUNCATION_MARKER + tail[-self.half:]
+        if self.truncated:
+            return ''.join(self.head) + TRUNCATION_MARKER + tail
+        return ''.join(self.head) + tail
+
+
+def extract_pages_to_file(path, filename, out_path, sample_chars):
+    """Extract and filter a document's pages into a JSON-lines file (used by batch uploads).
+
+    Returns (page_count, sample), where sample is a HeadTailSample of the
+    text, so only a bounded amount of text crosses the process boundary.
+    """
+    sample = HeadTailSample(sample_chars)
+    count = 0
+    with open(out_path, 'w', encoding='utf-8') as out:
+        for number, text in iter_filtered_pages(path, filename):
+            out.write(json.dumps([number, text]) + '\n')
+            sample.add(text + '\n')
+            count += 1
+    return count, sample.text()
+
+
+def read_pages_file(path):
+    """Yield the (page_number, text) pairs written by extract_pages_to_file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            number, text = json.loads(line)
+            yield number, text
+
+
+def parse_page_ranges(spec, max_ranges=50):
+    """Parse "3", "1-5" or "1-5,9,12-14" into [(start, end), ...]. Raises ValueError."""
+    if isinstance(spec, int):
+        spec = str(spec)
+    if not isinstance(spec, str) or not spec.strip():
+        raise ValueError("Page range must be a string like '1-5,9'")
+    ranges = []
+    for part in spec.split(','):
+        match = PAGE_RANGE_RE.match(part)
+        if not match:
+            raise ValueError(f"Invalid page range: '{part.strip()}'")
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range: '{part.strip()}'")
+        ranges.append((start, end))
+    if len(ranges) > max_ranges:
+        raise ValueError(f"Too many page ranges (max {max_ranges})")
+    return ranges
+
+
+def in_page_ranges(page_number, page_ranges):
+    return not page_ranges or any(start <= page_number <= end for start, end in page_ranges)
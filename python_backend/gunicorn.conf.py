@@ -0,0 +1,31 @@
+"""Gunicorn settings: load the app once in the master and fork workers from it.
+
+With preload_app the master imports the app (and, with STARTUP_MODE=preload,
+the PDF/markdown engines and numpy) before forking, so workers start without
+re-importing anything and share those pages copy-on-write.
+"""
+
+import gc
+import os
+
+os.environ.setdefault("STARTUP_MODE", "preload")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers don't write to (and un-share) those pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers.
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,112 @@
+"""Per-operation model selection and hedged requests for Gemini calls."""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class LatencyTracker:
+    """Rolling window of recent latencies per key."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, latency_ms):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(latency_ms)
+
+    def percentile(self, key, pct):
+        """The pct-th percentile latency for `key`, or None until enough samples exist."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+class ModelRouter:
+    """Maps operations to model tiers and decides when to hedge.
+
+    `tiers` maps a tier name to a Gemini model, `operation_tiers` maps an
+    operation to a tier. `hedging` maps an operation to its hedge settings
+    ({"percentile", "default_delay_ms", "min_delay_ms"}); operations not in
+    it are never hedged.
+    """
+
+    def __init__(self, api_base, api_key, tiers, operation_tiers, hedging, default_tier="standard"):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.tiers = tiers
+        self.operation_tiers = operation_tiers
+        self.hedging = hedging
+        self.default_tier = default_tier
+        self.latency = LatencyTracker()
+
+    def model_for(self, operation):
+        tier = self.operation_tiers.get(operation, self.default_tier)
+        return self.tiers.get(tier, self.tiers[self.default_tier])
+
+    def url_for(self, model, streaming=False):
+        method = "streamGenerateContent" if streaming else "generateContent"
+        return f"{self.api_base}/models/{model}:{method}?key={self.api_key}"
+
+    def observe(self, operation, model, latency_ms):
+        self.latency.observe((operation, model), latency_ms)
+
+    def hedge_delay(self, operation, model):
+        """Seconds to wait before firing a backup request, or None if the operation isn't hedged."""
+        settings = self.hedging.get(operation)
+        if settings is None:
+            return None
+        delay_ms = self.latency.percentile((operation, model), settings.get("percentile", 95))
+        if delay_ms is None:
+            delay_ms = settings.get("default_delay_ms", 5000)
+        return max(delay_ms, settings.get("min_delay_ms", 250)) / 1000.0
+
+
+def hedged_call(executor, call, delay, is_good, on_discarded=None):
+    """Run `call`, firing one backup copy if it hasn't answered within `delay` seconds.
+
+    Returns (result, hedged, elapsed_ms): the first result for which `is_good`
+    is true, whether a backup was fired, and the time taken measured from when
+    the primary was sent. A primary that fails before the delay is retried
+    immediately by the backup. If both fail, the backup's result is returned.
+
+    When a backup was fired, the other call's result is passed to
+    `on_discarded(result, is_primary)` once it finishes, from an executor
+    thread if it is still running, so its cost and latency aren't lost.
+    """
+    started = time.monotonic()
+    primary = executor.submit(call)
+    done, _ = wait([primary], timeout=delay)
+    if done and is_good(primary.result()):
+        return primary.result(), False, elapsed_ms(started)
+
+    backup = executor.submit(call)
+    pending = {backup} if done else {primary, backup}
+    winner = backup
+    while pending:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        good = [future for future in finished if is_good(future.result())]
+        if good:
+            winner = good[0]
+            break
+    elapsed = elapsed_ms(started)
+
+    if on_discarded is not None:
+        loser = primary if winner is backup else backup
+        loser.add_done_callback(lambda future: on_discarded(future.result(), future is primary))
+    return winner.result(), True, elapsed
+
+
+def elapsed_ms(started):
+    return int((time.monotonic() - started) * 1000)
@@ -0,0 +1,139 @@
+"""Token-aware prompt assembly.
+
+Prompts are packed to a per-operation token budget instead of ad-hoc
+character slices. Token counts are estimated locally (roughly four UTF-8
+bytes per token, which tracks Gemini's tokenizer closely enough for
+budgeting); the real counts come back in the API's usage metadata.
+"""
+
+HEAD = "head"            # keep the beginning, drop the end
+TAIL = "tail"            # keep the end, drop the beginning
+HEAD_TAIL = "head_tail"  # keep both ends, drop the middle
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+class PromptBudgetExceeded(Exception):
+    def __init__(self, operation, required, budget):
+        super().__init__(f"Prompt for '{operation}' needs ~{required} tokens, budget is {budget}")
+        self.operation = operation
+        self.required = required
+        self.budget = budget
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens, policy=HEAD):
+    """Cut `text` down to roughly `max_tokens` using the given policy."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    if policy == HEAD:
+        # Cut at the byte budget itself, so the result only depends on the
+        # start of the text (callers may pass just a prefix of a long document).
+        return text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+    # Scale by this text's own chars-per-token ratio so non-ASCII text is cut correctly.
+    max_chars = max(int(len(text) * max_tokens / tokens), 1)
+    if policy == TAIL:
+        return text[-max_chars:]
+    if policy == HEAD_TAIL:
+        half = max(max_chars - len(TRUNCATION_MARKER), 2) // 2
+        return text[:half] + TRUNCATION_MARKER + text[-half:]
+    raise ValueError(f"Unknown truncation policy: {policy}")
+
+
+def share_budget(sizes, budget):
+    """Split `budget` across items of the given sizes, giving small items all
+    they need and dividing the rest evenly between the large ones."""
+    allotted = [0] * len(sizes)
+    pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    remaining = budget
+    while pending:
+        share = remaining // len(pending)
+        i = pending[0]
+        if sizes[i] <= share:
+            allotted[i] = sizes[i]
+            remaining -= sizes[i]
+            pending.pop(0)
+        else:
+            for i in pending:
+                allotted[i] = share
+            break
+    return allotted
+
+
+class AssembledPrompt:
+    def __init__(self, system, documents_text, turn_text, estimated_tokens, truncated):
+        self.system = system
+        self.documents_text = documents_text
+        # Everything after the documents: history, user message and suffix.
+        self.turn_text = turn_text
+        self.estimated_tokens = estimated_tokens
+        self.truncated = truncated
+
+    @property
+    def text(self):
+        return "\n\n".join(part for part in [self.system, self.documents_text, self.turn_text] if part)
+
+
+def assemble_prompt(operation, budget, system="", documents=(), history=(), user="", suffix="",
+                    document_header="", document_policy=HEAD, history_share=0.25):
+    """Pack a prompt into `budget` estimated tokens.
+
+    Layout is system, documents, then the turn (history, user message,
+    suffix). The system prompt, user message and suffix are never cut; if they
+    don't fit, PromptBudgetExceeded is raised. When there is a turn, it gets
+    `history_share` of the budget and keeps its most recent history messages;
+    documents get the rest, split fairly and truncated with `document_policy`.
+    The document share doesn't depend on the turn, so the same documents
+    always produce the same prefix (which keeps upstream context caches valid).
+    """
+    documents = [d for d in documents if d]
+    history = list(history)
+    available = budget - estimate_tokens(system) - estimate_tokens(document_header)
+    has_turn = bool(history or user or suffix)
+    documents_budget = int(available * (1 - history_share)) if has_turn and documents else available
+    turn_budget = available - documents_budget if documents else available
+
+    turn_fixed = estimate_tokens(user) + estimate_tokens(suffix)
+    if available < 0 or turn_fixed > turn_budget:
+        required = budget - available + turn_fixed
+        raise PromptBudgetExceeded(operation, required, budget)
+    truncated = {}
+
+    kept_history = []
+    used = turn_fixed
+    for message in reversed(history):
+        cost = estimate_tokens(message)
+        if used + cost > turn_budget:
+            break
+        kept_history.append(message)
+        used += cost
+    kept_history.reverse()
+    if len(kept_history) < len(history):
+        truncated["history"] = len(history) - len(kept_history)
+
+    kept_documents = []
+    for text, allotted in zip(documents, share_budget([estimate_tokens(d) for d in documents], documents_budget)):
+        cut = truncate_to_tokens(text, allotted, document_policy)
+        if len(cut) < len(text):
+            truncated["documents"] = truncated.get("documents", 0) + 1
+        kept_documents.append(cut)
+
+    documents_text = ""
+    if kept_documents:
+        documents_text = "\n\n".join(kept_documents)
+        if document_header:
+            documents_text = f"{document_header}\n{documents_text}"
+
+    turn_text = "\n\n".join(part for part in [*kept_history, user, suffix] if part)
+    prompt = AssembledPrompt(system, documents_text, turn_text, 0, truncated)
+    prompt.estimated_tokens = estimate_tokens(prompt.text)
+    return prompt
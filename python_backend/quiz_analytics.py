@@ -0,0 +1,102 @@
+"""Quiz grading and the bookkeeping behind quiz analytics.
+
+Quizzes don't change once generated, so each quiz's answer key is parsed
+out of its JSON once and kept in a small per-process LRU cache. Grading an
+attempt then needs no database reads.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+# owner_id is the user who owns the quiz's session; answers[i] is question i's correct answer.
+AnswerKey = namedtuple("AnswerKey", ["quiz_id", "session_id", "owner_id", "answers"])
+
+# correct[i] is whether question i was answered correctly.
+GradedAttempt = namedtuple("GradedAttempt", ["quiz_id", "session_id", "answers", "score", "correct_count", "correct", "attempted_at"])
+
+
+def answer_key_from_quiz_data(quiz_id, session_id, owner_id, quiz_data):
+    questions = (quiz_data or {}).get("questions") or []
+    return AnswerKey(quiz_id, session_id, owner_id, tuple(q.get("correct_answer") for q in questions))
+
+
+def grade(answer_key, answers, attempted_at):
+    """Grade `answers` ({"<question index>": answer}) against the key, the way submit_quiz always has."""
+    correct = [str(i) in answers and answers[str(i)] == expected for i, expected in enumerate(answer_key.answers)]
+    correct_count = sum(correct)
+    total = len(answer_key.answers)
+    score = (correct_count / total) * 100 if total > 0 else 0
+    return GradedAttempt(answer_key.quiz_id, answer_key.session_id, answers, score, correct_count, correct, attempted_at)
+
+
+class AnswerKeyCache:
+    """LRU cache of AnswerKeys by quiz id."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, quiz_ids, load):
+        """Return {quiz_id: AnswerKey} for the ids that exist.
+
+        `load(missing_ids)` is called once with the ids not in the cache and
+        returns their AnswerKeys.
+        """
+        found = {}
+        with self._lock:
+            for quiz_id in quiz_ids:
+                key = self._entries.get(quiz_id)
+                if key is not None:
+                    self._entries.move_to_end(quiz_id)
+                    found[quiz_id] = key
+        missing = [quiz_id for quiz_id in quiz_ids if quiz_id not in found]
+        if missing:
+            loaded = load(missing)
+            with self._lock:
+                for key in loaded:
+                    self._entries[key.quiz_id] = key
+                    self._entries.move_to_end(key.quiz_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            found.update((key.quiz_id, key) for key in loaded)
+        return found
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            self._entries.pop(quiz_id, None)
+
+
+def aggregate(user_id, graded_attempts):
+    """Fold graded attempts into the increments for the two aggregate tables.
+
+    Returns (user_stats, question_stats):
+    user_stats maps quiz_id to a dict of UserQuizStat increments, and
+    question_stats maps (quiz_id, question_index) to (attempts, correct).
+    """
+    user_stats = {}
+    question_stats = {}
+    for attempt in sorted(graded_attempts, key=lambda a: a.attempted_at):
+        stats = user_stats.setdefault(attempt.quiz_id, {
+            "user_id": user_id,
+            "quiz_id": attempt.quiz_id,
+            "session_id": attempt.session_id,
+            "attempts": 0,
+            "total_score": 0.0,
+            "best_score": 0.0,
+            "last_score": 0.0,
+            "last_attempted_at": None,
+            "questions_answered": 0,
+            "questions_correct": 0,
+        })
+        stats["attempts"] += 1
+        stats["total_score"] += attempt.score
+        stats["best_score"] = max(stats["best_score"], attempt.score)
+        stats["last_score"] = attempt.score
+        stats["last_attempted_at"] = attempt.attempted_at
+        stats["questions_answered"] += len(attempt.correct)
+        stats["questions_correct"] += attempt.correct_count
+        for index, is_correct in enumerate(attempt.correct):
+            attempts, correct = question_stats.get((attempt.quiz_id, index), (0, 0))
+            question_stats[(attempt.quiz_id, index)] = (attempts + 1, correct + int(is_correct))
+    return user_stats, question_stats
@@ -0,0 +1,52 @@
+"""Versioned cache of serialized JSON responses.
+
+Entries are keyed by a scope (e.g. "session:12:quizzes"), the scope's
+current change counter and a variant (anything else the body depends on,
+such as the URL root used in absolute links). A write bumps the counter,
+which makes old entries unreachable. They age out of the LRU instead of
+being invalidated.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_etag(scope, version, variant=""):
+    """Strong ETag value (without quotes) for a scope at a version."""
+    digest = hashlib.sha1(f"{scope}|{variant}".encode("utf-8")).hexdigest()[:12]
+    return f"{digest}-{version}"
+
+
+class ResponseCache:
+    """Byte-bounded LRU of serialized response bodies."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size}
@@ -0,0 +1,191 @@
+"""SQLite FTS5 full-text search over a user's sessions, messages, documents and notes.
+
+Each searchable table gets an external-content FTS5 index fed by a view that
+adds an ``owner`` column ("u<user_id>"). Queries filter on that column inside
+FTS, so a search only walks the current user's postings instead of matching
+everyone's rows and filtering afterwards. Triggers on the base tables keep
+the indexes in sync on insert, update and delete.
+"""
+
+import re
+
+from sqlalchemy import text
+
+# kind -> (base table, view query, [(indexed column, base table column)], column used for snippets)
+INDEXES = {
+    "session": (
+        "chat_session",
+        "SELECT s.id AS id, s.id AS session_id, 'u' || s.user_id AS owner, s.title AS title "
+        "FROM chat_session s",
+        [("title", "title")],
+        "title",
+    ),
+    "message": (
+        "chat_message",
+        "SELECT m.id AS id, m.session_id AS session_id, 'u' || s.user_id AS owner, m.content AS content "
+        "FROM chat_message m JOIN chat_session s ON s.id = m.session_id",
+        [("content", "content")],
+        "content",
+    ),
+    "document": (
+        "uploaded_file",
+        "SELECT f.id AS id, f.session_id AS session_id, 'u' || s.user_id AS owner, "
+        "f.filename AS filename, f.full_text_content AS body "
+        "FROM uploaded_file f JOIN chat_session s ON s.id = f.session_id",
+        [("filename", "filename"), ("body", "full_text_content")],
+        "body",
+    ),
+    # Document text is stored per page; "document" above still covers filenames
+    # and the text of documents uploaded before page storage.
+    "page": (
+        "document_page",
+        "SELECT p.id AS id, f.session_id AS session_id, 'u' || s.user_id AS owner, p.content AS body, "
+        "p.file_id AS file_id, p.page_number AS page_number "
+        "FROM document_page p JOIN uploaded_file f ON f.id = p.file_id JOIN chat_session s ON s.id = f.session_id",
+        [("body", "content")],
+        "body",
+    ),
+    "note": (
+        "session_note",
+        "SELECT n.id AS id, n.session_id AS session_id, 'u' || s.user_id AS owner, "
+        "n.title AS title, n.markdown_content AS body "
+        "FROM session_note n JOIN chat_session s ON s.id = n.session_id",
+        [("title", "title"), ("body", "markdown_content")],
+        "body",
+    ),
+}
+
+# Extra view columns returned with each hit of a kind, to locate it.
+LOCATOR_COLUMNS = {"page": ("file_id", "page_number")}
+
+# Matches in short descriptive columns rank above matches in long bodies.
+COLUMN_WEIGHTS = {"title": 4.0, "filename": 4.0}
+
+SNIPPET_START = "**"
+SNIPPET_END = "**"
+SNIPPET_TOKENS = 16
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _owner_expr(table, row):
+    if table == "chat_session":
+        return f"'u' || {row}.user_id"
+    if table == "document_page":
+        return (
+            "(SELECT 'u' || s.user_id FROM uploaded_file f JOIN chat_session s ON s.id = f.session_id "
+            f"WHERE f.id = {row}.file_id)"
+        )
+    return f"(SELECT 'u' || user_id FROM chat_session WHERE id = {row}.session_id)"
+
+
+def _schema_statements(kind):
+    table, view_query, columns, _ = INDEXES[kind]
+    view = f"{table}_search"
+    fts = f"{table}_fts"
+    base_columns = [base for _, base in columns]
+    fts_columns = ", ".join(["owner"] + [indexed for indexed, _ in columns])
+    new_values = ", ".join([_owner_expr(table, "new")] + [f"new.{c}" for c in base_columns])
+    old_values = ", ".join([_owner_expr(table, "old")] + [f"old.{c}" for c in base_columns])
+    watched = ", ".join(base_columns)
+
+    return fts, [
+        f"CREATE VIEW IF NOT EXISTS {view} AS {view_query}",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{fts_columns}, content='{view}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {fts_columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {fts_columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {watched} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {fts_columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {fts_columns}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def is_available(engine):
+    """Search is built on FTS5, so it only exists on SQLite."""
+    return engine.dialect.name == "sqlite"
+
+
+def init_search_index(engine):
+    """Create the FTS views, tables and triggers, backfilling any index that is new.
+
+    Does nothing on databases other than SQLite. Returns whether search is available.
+    """
+    if not is_available(engine):
+        return False
+
+    with engine.begin() as conn:
+        for kind in INDEXES:
+            fts, statements = _schema_statements(kind)
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+            ).first()
+            for statement in statements:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    return True
+
+
+def build_match_query(query):
+    """Turn free text into a safe FTS5 query: every word must match, the last as a prefix."""
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*']
+    return " ".join(terms)
+
+
+def search(conn, user_id, query, kinds=None, limit=20):
+    """Ranked search over the user's content. Returns a list of result dicts, best first.
+
+    `kinds` limits the search to some keys of INDEXES (all of them if None).
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    selects = []
+    params = {"start": SNIPPET_START, "end": SNIPPET_END, "limit": limit}
+    for kind in kinds or INDEXES:
+        table, _, columns, snippet_column = INDEXES[kind]
+        fts = f"{table}_fts"
+        snippet_index = 1 + [indexed for indexed, _ in columns].index(snippet_column)
+        # The owner column matches every row of the user, so it mustn't affect ranking.
+        weights = ", ".join(["0.0"] + [str(COLUMN_WEIGHTS.get(indexed, 1.0)) for indexed, _ in columns])
+        locator = LOCATOR_COLUMNS.get(kind)
+        file_column, page_column = [f"v.{c}" for c in locator] if locator else ["NULL", "NULL"]
+        # The user's terms are limited to the content columns; left unfiltered
+        # they would also match the owner token (e.g. a search for "u1").
+        content_columns = " ".join(indexed for indexed, _ in columns)
+        params[f"match_{kind}"] = f"owner:\"u{int(user_id)}\" AND {{{content_columns}}}:({match})"
+        selects.append(
+            f"SELECT '{kind}' AS kind, {fts}.rowid AS id, v.session_id AS session_id, "
+            f"{file_column} AS file_id, {page_column} AS page_number, "
+            f"snippet({fts}, {snippet_index}, :start, :end, '…', {SNIPPET_TOKENS}) AS snippet, "
+            f"bm25({fts}, {weights}) AS rank "
+            f"FROM {fts} JOIN {table}_search v ON v.id = {fts}.rowid "
+            f"WHERE {fts} MATCH :match_{kind}"
+        )
+
+    sql = (
+        "SELECT r.kind, r.id, r.session_id, r.file_id, r.page_number, s.title AS session_title, r.snippet, r.rank "
+        f"FROM ({' UNION ALL '.join(selects)}) r JOIN chat_session s ON s.id = r.session_id "
+        "ORDER BY r.rank LIMIT :limit"
+    )
+    rows = conn.execute(text(sql), params)
+    return [
+        {
+            "type": row.kind,
+            "id": row.id,
+            "session_id": row.session_id,
+            "session_title": row.session_title,
+            "file_id": row.file_id,
+            "page_number": row.page_number,
+            "snippet": row.snippet,
+            "rank": row.rank,
+        }
+        for row in rows
+    ]
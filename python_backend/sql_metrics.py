@@ -0,0 +1,83 @@
+"""Counting and timing of SQL statements.
+
+Listeners on every Engine feed each statement into the active recorders:
+the current request's (kept on flask.g, see start_request) and any enclosing
+query_budget blocks. A route with a lazy-load chain shows up as a query
+count that grows with the data; query_budget turns that into a failure.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_budgets = ContextVar("sql_query_budgets", default=())
+
+
+class QueryStats:
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.total_ms = 0.0
+        # Only kept where they are reported (query_budget); requests just count.
+        self.statements = [] if keep_statements else None
+
+    def record(self, statement, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def start_request():
+    g.sql_stats = QueryStats()
+
+
+def request_stats():
+    """The current request's QueryStats, or None outside a request."""
+    return g.get("sql_stats") if has_app_context() else None
+
+
+@contextmanager
+def query_budget(max_queries):
+    """Raise QueryBudgetExceeded if the block runs more than `max_queries` SQL statements.
+
+    Meant for tests, around test-client calls:
+
+        with query_budget(5):
+            client.get(f"/sessions/{session_id}")
+    """
+    stats = QueryStats(keep_statements=True)
+    token = _budgets.set(_budgets.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _budgets.reset(token)
+    if stats.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{stats.count} SQL statements run, budget was {max_queries}:\n" + "\n".join(stats.statements)
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["sql_metrics_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("sql_metrics_started", None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = request_stats()
+    if stats is not None:
+        stats.record(statement, elapsed_ms)
+    for budget in _budgets.get():
+        budget.record(statement, elapsed_ms)
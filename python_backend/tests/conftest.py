@@ -0,0 +1,130 @@
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configuration is read when the app module is imported, so set it up first:
+# no network (hashing embedder, in-process context cache, no hedging) and
+# rate limits that a test run can't hit.
+_tmp = tempfile.mkdtemp(prefix="aurenlm-tests-")
+os.environ.update({
+    "VECTOR_EMBEDDER": "hashing",
+    "VECTOR_STORE_FOLDER": os.path.join(_tmp, "vector_store"),
+    "CONTEXT_CACHE_BACKEND": "local",
+    "GEMINI_HEDGING": "{}",
+    "ADMISSION_INTERACTIVE_BURST": "10000",
+    "ADMISSION_BATCH_BURST": "10000",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aurenlm  # noqa: E402
+
+QUIZ_JSON = json.dumps({
+    "title": "Cells",
+    "questions": [
+        {"question": "What do cells do?", "options": ["Divide", "Sing"], "correct_answer": "Divide"},
+        {"question": "Where is DNA?", "options": ["Nucleus", "Moon"], "correct_answer": "Nucleus"},
+    ],
+})
+
+
+def fake_gemini_response(prompt, cached_content=None, model=None):
+    text = QUIZ_JSON if "multiple-choice quiz" in prompt else "Cells divide to grow."
+    return {"text": text, "usage": {"prompt_tokens": 10, "output_tokens": 5}, "latency_ms": 1, "model": model}
+
+
+def fake_gemini_streaming_response(prompt, cached_content=None, usage=None, model=None):
+    if usage is not None:
+        usage.update({"model": model, "latency_ms": 1})
+    yield "Cells divide to grow."
+
+
+@pytest.fixture(scope="session")
+def app():
+    with pytest.MonkeyPatch.context() as mp:
+        # The log file goes under the working directory.
+        mp.chdir(_tmp)
+        application = aurenlm.create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(_tmp, "test.db"),
+            "UPLOAD_FOLDER": os.path.join(_tmp, "uploads"),
+        })
+    aurenlm.init_db(application)
+    return application
+
+
+@pytest.fixture(autouse=True)
+def fake_gemini(monkeypatch):
+    monkeypatch.setattr(aurenlm, "get_gemini_response", fake_gemini_response)
+    monkeypatch.setattr(aurenlm, "get_gemini_streaming_response", fake_gemini_streaming_response)
+    monkeypatch.setattr(aurenlm, "markdown_to_pdf", lambda markdown_content, output_path: open(output_path, "wb").close())
+
+
+class Client:
+    """Test client that reads and closes every response, so admission slots are always released."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, url, method="GET", **kwargs):
+        response = self.client.open(url, method=method, **kwargs)
+        response.get_data()
+        response.close()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.open(url, "GET", **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.open(url, "POST", **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.open(url, "DELETE", **kwargs)
+
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture
+def make_client(app):
+    """Make clients, each logged in as a new user (its `user_id` is set)."""
+
+    def make():
+        client = Client(app.test_client())
+        username = f"user{next(_usernames)}"
+        client.post("/register", json={"username": username, "password": "secret"})
+        assert client.post("/login", json={"username": username, "password": "secret"}).status_code == 200
+        with app.app_context():
+            client.user_id = aurenlm.User.query.filter_by(username=username).one().id
+        return client
+
+    return make
+
+
+@pytest.fixture
+def client(make_client):
+    """A client logged in as a new user."""
+    return make_client()
+
+
+@pytest.fixture
+def make_session(client):
+    """Create a session with `files` uploaded documents and `quizzes` taken quizzes."""
+
+    def make(files=1, quizzes=0):
+        session_id = client.post("/sessions", json={}).json["id"]
+        for i in range(files):
+            text = f"Document {i}. Cells divide and grow.\n".encode() * 50
+            response = client.post("/upload", data={"session_id": str(session_id), "file": (io.BytesIO(text), f"doc{i}.txt")})
+            assert response.status_code == 200, response.json
+        for _ in range(quizzes):
+            response = client.post(f"/api/sessions/{session_id}/generate_quiz", json={})
+            assert response.status_code == 200, response.json
+            response = client.post(f"/api/quizzes/{response.json['id']}/submit", json={"answers": {"0": "Divide", "1": "Moon"}})
+            assert response.status_code == 200, response.json
+        return session_id
+
+    return make
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+import app as aurenlm
+from admission import AdmissionController, AdmissionRejected, BATCH, INTERACTIVE
+
+
+def controller(global_concurrency=3, interactive_reserved=1, rate=60, burst=2, **kwargs):
+    return AdmissionController(global_concurrency, interactive_reserved, {INTERACTIVE: (rate, burst), BATCH: (rate, burst)}, **kwargs)
+
+
+def test_rate_limit_rejects_with_retry_hint():
+    admission = controller(rate=60, burst=2)
+    admission.acquire(1, INTERACTIVE).release()
+    admission.acquire(1, INTERACTIVE).release()
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire(1, INTERACTIVE)
+    assert rejected.value.retry_after == 1
+    # Other users and other lanes have their own buckets.
+    admission.acquire(2, INTERACTIVE).release()
+    admission.acquire(1, BATCH).release()
+
+
+def test_batch_cannot_use_the_interactive_reserve():
+    admission = controller(global_concurrency=3, interactive_reserved=1, burst=10)
+    tickets = [admission.acquire(user_id, BATCH) for user_id in (1, 2)]
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.acquire(3, BATCH)
+    assert rejected.value.retry_after == 5
+
+    tickets.append(admission.acquire(3, INTERACTIVE))
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(4, INTERACTIVE)
+    assert admission.stats()["in_flight"] == {INTERACTIVE: 1, BATCH: 2}
+
+    tickets[0].release()
+    tickets[0].release()
+    assert admission.stats()["in_flight"] == {INTERACTIVE: 1, BATCH: 1}
+    # Batch is measured against the whole pool, so chat still holds it back.
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(3, BATCH)
+    tickets[2].release()
+    admission.acquire(3, BATCH)
+
+
+def test_busy_rejection_and_refund_return_the_token():
+    admission = controller(global_concurrency=1, interactive_reserved=0, burst=1)
+    ticket = admission.acquire(1, BATCH)
+    # Rejected for lack of a slot: user 2 keeps its one token.
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(2, BATCH)
+    ticket.release()
+    ticket.refund()
+    ticket.refund()
+    admission.acquire(2, BATCH).release()
+    admission.acquire(1, BATCH).release()
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(1, BATCH)
+
+
+def test_refilled_buckets_are_dropped():
+    admission = controller(rate=60_000, burst=1, sweep_interval=0)
+    for user_id in range(100):
+        admission.acquire(user_id, INTERACTIVE).release()
+    time.sleep(0.01)
+    admission.acquire("active", INTERACTIVE).release()
+    assert list(admission._buckets) == [("active", INTERACTIVE)]
+
+
+@pytest.fixture
+def strict_admission(monkeypatch):
+    """One interactive request per user, refilling about once a minute."""
+    admission = controller(global_concurrency=4, interactive_reserved=1, rate=1, burst=1)
+    monkeypatch.setattr(aurenlm, "admission", admission)
+    return admission
+
+
+def test_route_rejects_with_429_and_retry_after(client, make_session, strict_admission):
+    session_id = make_session(files=1)
+    assert client.post(f"/api/sessions/{session_id}/generate-title").status_code == 200
+
+    response = client.post(f"/api/sessions/{session_id}/generate-title")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == response.json["retry_after"] > 0
+    assert strict_admission.stats()["in_flight"] == {INTERACTIVE: 0, BATCH: 0}
+
+
+def test_turned_away_requests_get_their_token_back(client, strict_admission):
+    empty_session = client.post("/sessions", json={}).json["id"]
+    for _ in range(3):
+        # No documents to title.
+        assert client.post(f"/api/sessions/{empty_session}/generate-title").status_code == 400
+        assert client.post("/api/sessions/999999/generate-title").status_code == 404
+        assert client.post("/gemini_completion", json={"session_id": empty_session, "message": ""}).status_code == 400
+    assert strict_admission.stats()["in_flight"] == {INTERACTIVE: 0, BATCH: 0}
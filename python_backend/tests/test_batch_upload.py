@@ -0,0 +1,52 @@
+import io
+import json
+import os
+
+import pytest
+
+import app as aurenlm
+
+
+def die(*args):
+    """Stands in for extraction in a worker that gets killed (e.g. out of memory)."""
+    os._exit(1)
+
+
+def upload_batch(client, session_id, count=2):
+    files = [(io.BytesIO(f"Document {i}. Cells divide.\n".encode() * 20), f"doc{i}.txt") for i in range(count)]
+    response = client.post("/upload/batch", data={"session_id": str(session_id), "files": files})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.fixture
+def session_id(client):
+    return client.post("/sessions", json={}).json["id"]
+
+
+def test_batch_upload(client, session_id):
+    events = upload_batch(client, session_id)
+    assert [e["type"] for e in events].count("file") == 2
+    assert events[-1] == {"type": "done", "uploaded": 2, "failed": 0}
+
+
+def test_dead_extraction_worker_fails_its_files_and_the_next_batch_recovers(client, session_id, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(aurenlm, "extract_pages_to_file", die)
+        events = upload_batch(client, session_id)
+    assert [e["type"] for e in events] == ["error", "error", "done"]
+    assert events[-1] == {"type": "done", "uploaded": 0, "failed": 2}
+
+    events = upload_batch(client, session_id)
+    assert events[-1] == {"type": "done", "uploaded": 2, "failed": 0}
+
+
+def test_batch_replaces_an_already_broken_pool(client, session_id, monkeypatch):
+    executor = aurenlm.get_extraction_executor()
+    with pytest.raises(aurenlm.BrokenProcessPool):
+        executor.submit(die).result()
+    assert aurenlm.extraction_executor is executor
+
+    events = upload_batch(client, session_id)
+    assert events[-1] == {"type": "done", "uploaded": 2, "failed": 0}
+    assert aurenlm.extraction_executor is not executor
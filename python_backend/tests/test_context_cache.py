@@ -0,0 +1,60 @@
+import pytest
+
+from context_cache import ContextCacheError, LocalContextCacheBackend, SessionContextCache
+
+DOCUMENTS = "Cells divide and grow. " * 100
+
+
+def make_cache(min_tokens=10):
+    backend = LocalContextCacheBackend()
+    return backend, SessionContextCache(backend, ttl_seconds=3600, min_tokens=min_tokens)
+
+
+def test_registers_once_and_reuses_the_handle():
+    backend, cache = make_cache()
+    first = cache.get(1, "model", "system", [1, 2], DOCUMENTS)
+    second = cache.get(1, "model", "system", [2, 1], DOCUMENTS)
+    assert first is second
+    assert list(backend.entries) == [first.name]
+
+
+def test_render_splices_the_cached_prefix_back_in():
+    _, cache = make_cache()
+    context = cache.get(1, "model", "system", [1], DOCUMENTS)
+    prompt, cached_content = cache.render(context, "User: hi")
+    assert prompt == "\n\n".join(["system", DOCUMENTS, "User: hi"])
+    assert cached_content is None
+
+
+def test_small_documents_are_sent_inline():
+    backend, cache = make_cache(min_tokens=10_000)
+    assert cache.get(1, "model", "system", [1], DOCUMENTS) is None
+    assert not backend.entries
+
+
+def test_changed_documents_replace_the_bundle():
+    backend, cache = make_cache()
+    old = cache.get(1, "model", "system", [1], DOCUMENTS)
+    new = cache.get(1, "model", "system", [1, 2], DOCUMENTS + "More.")
+    assert new.name != old.name
+    assert list(backend.entries) == [new.name]
+
+
+def test_invalidate_deletes_the_bundle():
+    backend, cache = make_cache()
+    context = cache.get(1, "model", "system", [1], DOCUMENTS)
+    cache.invalidate(1)
+    assert not backend.entries
+    with pytest.raises(ContextCacheError):
+        backend.render(context.name, "User: hi")
+
+
+def test_expired_handle_is_registered_again():
+    backend, cache = make_cache()
+    old = cache.get(1, "model", "system", [1], DOCUMENTS)
+    # Due for a refresh, but the backend no longer knows the handle.
+    old.expires_at = 0
+    backend.entries.clear()
+    new = cache.get(1, "model", "system", [1], DOCUMENTS)
+    assert new.name != old.name
+    assert new.name in backend.entries
@@ -0,0 +1,81 @@
+import io
+import sqlite3
+
+import pytest
+
+import app as aurenlm
+from prompt_budget import assemble_prompt
+
+
+def upload(client, session_id, text, filename="doc.txt"):
+    response = client.post("/upload", data={"session_id": str(session_id), "file": (io.BytesIO(text.encode()), filename)})
+    assert response.status_code == 200, response.json
+    return response.json["file_id"]
+
+
+def test_indexing_does_not_block_writers(app, client, monkeypatch):
+    """Embedding runs between page reads, so other requests can commit meanwhile."""
+    monkeypatch.setattr(aurenlm, "DOCUMENT_PAGE_READ_BATCH", 2)
+    store = aurenlm.get_vector_store()
+    monkeypatch.setattr(store, "embed_batch", 2)
+    database = app.config["SQLALCHEMY_DATABASE_URI"].removeprefix("sqlite:///")
+    embed = store.embedder.embed
+    errors = []
+
+    def embed_and_write(texts):
+        connection = sqlite3.connect(database, timeout=0)
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS write_probe (n INTEGER)")
+            connection.execute("INSERT INTO write_probe VALUES (1)")
+            connection.commit()
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        finally:
+            connection.close()
+        return embed(texts)
+
+    monkeypatch.setattr(store.embedder, "embed", embed_and_write)
+    session_id = client.post("/sessions", json={}).json["id"]
+    upload(client, session_id, "Cells divide and grow in many ways.\n" * 1200)
+    assert errors == []
+
+
+def test_bounded_reads_build_the_same_prompt(app, client):
+    session_id = client.post("/sessions", json={}).json["id"]
+    for i, lines in enumerate([2, 40, 900, 300]):
+        upload(client, session_id, f"Document {i} talks about données and 细胞 at length.\n" * lines, f"doc{i}.txt")
+    with app.app_context():
+        files = aurenlm.session_files(session_id)
+        for budget in (300, 2000, 8000, 100000):
+            full = aurenlm.document_texts(files)
+            bounded = aurenlm.document_texts(files, max_chars=budget * 4)
+            assert sum(map(len, bounded.values())) <= sum(map(len, full.values()))
+            prompts = [
+                assemble_prompt("notes", budget, system="Summarise.", documents=[texts[f.id] for f in files if f.id in texts])
+                for texts in (full, bounded)
+            ]
+            assert prompts[0].text == prompts[1].text
+            assert prompts[0].truncated == prompts[1].truncated
+
+
+@pytest.fixture
+def cached_bundles(monkeypatch):
+    monkeypatch.setattr(aurenlm.session_context_cache, "min_tokens", 100)
+    return aurenlm.session_context_cache.backend.entries
+
+
+def test_chat_about_one_file_keeps_the_session_bundle(client, cached_bundles):
+    session_id = client.post("/sessions", json={}).json["id"]
+    file_id = upload(client, session_id, "Mitochondria produce ATP for the cell.\n" * 40, "a.txt")
+    upload(client, session_id, "Newton's laws describe motion.\n" * 40, "b.txt")
+
+    def chat(**selection):
+        response = client.post("/gemini_completion", json={"session_id": session_id, "message": "Explain.", **selection})
+        assert response.status_code == 200
+        return set(cached_bundles)
+
+    bundles = chat()
+    assert len(bundles) == 1
+    assert chat(file_id=file_id) == bundles
+    assert chat(file_id=file_id, pages="1") == bundles
+    assert chat() == bundles
@@ -0,0 +1,67 @@
+"""SQL statement budgets for the routes that used to lazy-load per file or per quiz.
+
+Each route runs against a small and a larger session; the budget is the same
+for both, so a query that starts repeating per row fails here.
+"""
+
+import pytest
+
+from sql_metrics import query_budget, QueryBudgetExceeded
+
+SIZES = [1, 8]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_generate_title(client, make_session, size):
+    session_id = make_session(files=size)
+    with query_budget(8):
+        response = client.post(f"/api/sessions/{session_id}/generate-title")
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_generate_notes(client, make_session, size):
+    session_id = make_session(files=size)
+    with query_budget(10):
+        response = client.post(f"/api/sessions/{session_id}/generate_notes", json={})
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_generate_quiz(client, make_session, size):
+    session_id = make_session(files=size, quizzes=size)
+    with query_budget(9):
+        response = client.post(f"/api/sessions/{session_id}/generate_quiz", json={})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_chat(client, make_session, size):
+    session_id = make_session(files=size)
+    with query_budget(10):
+        response = client.post("/gemini_completion", json={"session_id": session_id, "message": "Why do cells divide?"})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_session_data(client, make_session, size):
+    session_id = make_session(files=size)
+    with query_budget(5):
+        response = client.get(f"/sessions/{session_id}")
+    assert response.status_code == 200
+    assert len(response.json["files"]) == size
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_session_delete(client, make_session, size):
+    session_id = make_session(files=size, quizzes=size)
+    with query_budget(18):
+        response = client.delete(f"/sessions/{session_id}")
+    assert response.status_code == 200
+
+
+def test_budget_overrun_lists_statements(client, make_session):
+    session_id = make_session(files=1)
+    with pytest.raises(QueryBudgetExceeded, match="SELECT"):
+        with query_budget(0):
+            client.get(f"/sessions/{session_id}")
@@ -0,0 +1,113 @@
+import io
+
+import pytest
+
+import app as aurenlm
+
+RIGHT = {"0": "Divide", "1": "Nucleus"}
+HALF = {"0": "Divide", "1": "Moon"}
+WRONG = {"0": "Sing", "1": "Moon"}
+
+
+def new_quiz(client, make_session):
+    session_id = make_session(files=1)
+    response = client.post(f"/api/sessions/{session_id}/generate_quiz", json={})
+    assert response.status_code == 200
+    return response.json["id"]
+
+
+def submit(client, quiz_id, answers):
+    response = client.post(f"/api/quizzes/{quiz_id}/submit", json={"answers": answers})
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def submit_batch(client, *submissions):
+    return client.post("/api/quizzes/submit_batch", json={"submissions": [
+        {"quiz_id": quiz_id, "answers": answers, "attempted_at": attempted_at}
+        for quiz_id, answers, attempted_at in submissions
+    ]})
+
+
+def progress(client, quiz_id):
+    response = client.get("/api/progress")
+    assert response.status_code == 200
+    return next(q for s in response.json["sessions"] for q in s["quizzes"] if q["quiz_id"] == quiz_id)
+
+
+def question_stats(client, quiz_id):
+    response = client.get(f"/api/quizzes/{quiz_id}/stats")
+    assert response.status_code == 200
+    return {q["question_index"]: (q["attempts"], q["correct"]) for q in response.json["questions"]}
+
+
+def test_submits_accumulate(client, make_session):
+    quiz_id = new_quiz(client, make_session)
+    assert [submit(client, quiz_id, answers)["score"] for answers in (RIGHT, HALF, WRONG)] == [100, 50, 0]
+
+    stats = progress(client, quiz_id)
+    assert stats["attempts"] == 3
+    assert stats["best_score"] == 100
+    assert stats["last_score"] == 0
+    assert stats["average_score"] == 50
+    assert stats["accuracy"] == pytest.approx(3 / 6)
+    assert question_stats(client, quiz_id) == {0: (3, 2), 1: (3, 1)}
+
+
+def test_older_offline_attempt_keeps_last_score(client, make_session):
+    quiz_id = new_quiz(client, make_session)
+    submit(client, quiz_id, HALF)
+    response = submit_batch(client, (quiz_id, RIGHT, "2020-01-02T10:00:00Z"), (quiz_id, WRONG, "2020-01-01T10:00:00Z"))
+    assert response.status_code == 200, response.json
+
+    stats = progress(client, quiz_id)
+    assert stats["attempts"] == 3
+    assert stats["best_score"] == 100
+    assert stats["last_score"] == 50
+    assert stats["accuracy"] == pytest.approx(3 / 6)
+
+
+def test_newer_attempts_in_a_batch_set_last_score_in_time_order(client, make_session):
+    quiz_id = new_quiz(client, make_session)
+    response = submit_batch(client, (quiz_id, WRONG, "2021-01-02T10:00:00Z"), (quiz_id, HALF, "2021-01-01T10:00:00Z"))
+    assert response.status_code == 200, response.json
+    assert progress(client, quiz_id)["last_score"] == 0
+
+
+def test_batch_with_a_foreign_quiz_stores_nothing(client, make_client, make_session):
+    own_quiz = new_quiz(client, make_session)
+    submit(client, own_quiz, HALF)
+    other = make_client()
+    other_session = other.post("/sessions", json={}).json["id"]
+    other.post("/upload", data={"session_id": str(other_session), "file": (io.BytesIO(b"Cells divide.\n" * 20), "doc.txt")})
+    foreign_quiz = other.post(f"/api/sessions/{other_session}/generate_quiz", json={}).json["id"]
+
+    response = submit_batch(client, (own_quiz, RIGHT, None), (foreign_quiz, RIGHT, None))
+    assert response.status_code == 403
+
+    assert progress(client, own_quiz)["attempts"] == 1
+    assert question_stats(client, own_quiz) == {0: (1, 1), 1: (1, 0)}
+    assert other.get("/api/progress").json["attempts"] == 0
+
+
+def snapshot():
+    users = {
+        (s.user_id, s.quiz_id): (s.session_id, s.attempts, s.total_score, s.best_score, s.last_score,
+                                 s.last_attempted_at, s.questions_answered, s.questions_correct)
+        for s in aurenlm.UserQuizStat.query.all()
+    }
+    questions = {(s.quiz_id, s.question_index): (s.attempts, s.correct) for s in aurenlm.QuizQuestionStat.query.all()}
+    return users, questions
+
+
+def test_rebuild_matches_incremental_aggregates(app, client, make_session):
+    quiz_id = new_quiz(client, make_session)
+    for answers in (HALF, WRONG, RIGHT):
+        submit(client, quiz_id, answers)
+    submit_batch(client, (quiz_id, RIGHT, "2019-05-01T10:00:00Z"), (quiz_id, WRONG, "2019-05-02T10:00:00+02:00"))
+
+    with app.app_context():
+        before = snapshot()
+        assert before[0]
+        aurenlm.rebuild_quiz_stats(chunk_size=2)
+        assert snapshot() == before
@@ -0,0 +1,75 @@
+"""Versioned ETags on the polled list endpoints: a 304 while nothing changed,
+a new ETag (and body) as soon as a write touches the list."""
+
+
+def fetch(client, url, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    response = client.get(url, headers=headers)
+    assert response.status_code in (200, 304), response.status_code
+    return response
+
+
+def assert_fresh(client, url, etag):
+    """The old ETag no longer matches: a full body comes back under a new ETag."""
+    response = fetch(client, url, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    return response
+
+
+def test_matching_etag_gets_304(client, make_session):
+    session_id = make_session(files=1, quizzes=1)
+    for url in ("/sessions", f"/api/sessions/{session_id}/quizzes", f"/api/sessions/{session_id}/notes"):
+        first = fetch(client, url)
+        assert first.status_code == 200
+        assert first.headers["Cache-Control"] == "private, no-cache"
+        etag = first.headers["ETag"]
+
+        second = fetch(client, url, etag)
+        assert second.status_code == 304
+        assert second.get_data() == b""
+        assert second.headers["ETag"] == etag
+
+
+def test_renaming_a_session_changes_the_sessions_etag(client):
+    session_id = client.post("/sessions", json={"title": "Before"}).json["id"]
+    etag = fetch(client, "/sessions").headers["ETag"]
+
+    response = client.open(f"/api/sessions/{session_id}/rename", "PUT", json={"title": "After"})
+    assert response.status_code == 200
+
+    response = assert_fresh(client, "/sessions", etag)
+    assert [s["title"] for s in response.json if s["id"] == session_id] == ["After"]
+
+
+def test_generating_a_quiz_changes_the_quizzes_etag(client, make_session):
+    session_id = make_session(files=1)
+    url = f"/api/sessions/{session_id}/quizzes"
+    etag = fetch(client, url).headers["ETag"]
+    assert fetch(client, url).json == []
+
+    quiz_id = client.post(f"/api/sessions/{session_id}/generate_quiz", json={}).json["id"]
+
+    response = assert_fresh(client, url, etag)
+    assert [q["id"] for q in response.json] == [quiz_id]
+
+
+def test_deleting_a_note_changes_the_notes_etag(client, make_session):
+    session_id = make_session(files=1)
+    url = f"/api/sessions/{session_id}/notes"
+    note_id = client.post(f"/api/sessions/{session_id}/generate_notes", json={}).json["id"]
+    etag = fetch(client, url).headers["ETag"]
+    assert [n["id"] for n in fetch(client, url).json] == [note_id]
+
+    assert client.delete(f"/api/session_notes/{note_id}").status_code == 200
+
+    response = assert_fresh(client, url, etag)
+    assert response.json == []
+
+
+def test_other_users_lists_are_not_served(client, make_client, make_session):
+    session_id = make_session(files=1, quizzes=1)
+    etag = fetch(client, f"/api/sessions/{session_id}/quizzes").headers["ETag"]
+    other = make_client()
+    response = other.get(f"/api/sessions/{session_id}/quizzes", headers={"If-None-Match": etag})
+    assert response.status_code == 403
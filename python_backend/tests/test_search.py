@@ -0,0 +1,81 @@
+import io
+
+import pytest
+from sqlalchemy import text
+
+import app as aurenlm
+import search_index
+
+TEXT = "Photosynthesis turns light into chemical energy.\n" * 20
+
+
+def fill_session(client):
+    """A session with a title, messages, a document and a note that all mention photosynthesis."""
+    session_id = client.post("/sessions", json={"title": "Photosynthesis basics"}).json["id"]
+    response = client.post("/upload", data={"session_id": str(session_id), "file": (io.BytesIO(TEXT.encode()), "photosynthesis.txt")})
+    file_id = response.json["file_id"]
+    client.post("/gemini_completion", json={"session_id": session_id, "message": "What is photosynthesis?"})
+    client.post(f"/api/sessions/{session_id}/generate_notes", json={"custom_text": TEXT, "custom_title": "Photosynthesis notes"})
+    return session_id, file_id
+
+
+def search(client, q, **params):
+    response = client.get("/search", query_string={"q": q, **params})
+    assert response.status_code == 200, response.json
+    return response.json["results"]
+
+
+@pytest.fixture
+def users(make_client):
+    alice, bob = make_client(), make_client()
+    return (alice, fill_session(alice)[0]), (bob, fill_session(bob)[0])
+
+
+def test_search_only_returns_own_rows(users):
+    (alice, alice_session), (bob, bob_session) = users
+    for client, own_session in [(alice, alice_session), (bob, bob_session)]:
+        results = search(client, "photosynthesis", limit=100)
+        assert {r["type"] for r in results} == set(search_index.INDEXES)
+        assert {r["session_id"] for r in results} == {own_session}
+
+
+def test_owner_tokens_are_not_searchable(users):
+    (alice, _), (bob, _) = users
+    for client in (alice, bob):
+        for owner in (f"u{alice.user_id}", f"u{bob.user_id}", f'owner:"u{alice.user_id}"'):
+            assert search(client, owner) == []
+
+
+def test_type_filter(users):
+    (alice, _), _ = users
+    results = search(alice, "photosynthesis", type="note,session")
+    assert {r["type"] for r in results} == {"note", "session"}
+
+
+def test_unknown_type_is_rejected(client):
+    response = client.get("/search", query_string={"q": "photosynthesis", "type": "session,bogus"})
+    assert response.status_code == 400
+    assert "bogus" in response.json["message"]
+
+
+def integrity_check(app):
+    with app.app_context():
+        with aurenlm.db.engine.begin() as conn:
+            for table, _, _, _ in search_index.INDEXES.values():
+                fts = f"{table}_fts"
+                # Raises if the index has drifted from its content.
+                conn.execute(text(f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"))
+
+
+def test_index_stays_consistent_after_deletes(app, client):
+    session_id, file_id = fill_session(client)
+    other_session, _ = fill_session(client)
+    integrity_check(app)
+
+    assert client.delete(f"/api/documents/{file_id}").status_code == 200
+    integrity_check(app)
+    assert not [r for r in search(client, "photosynthesis", limit=100) if r["type"] in ("document", "page") and r["session_id"] == session_id]
+
+    assert client.delete(f"/sessions/{session_id}").status_code == 200
+    integrity_check(app)
+    assert {r["session_id"] for r in search(client, "photosynthesis", limit=100)} == {other_session}
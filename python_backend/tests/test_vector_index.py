@@ -0,0 +1,73 @@
+import numpy as np
+
+from vector_index import HashingEmbedder, VectorStore, chunk_text
+
+PAGES = [
+    (1, "Mitochondria produce ATP, the energy currency of the cell. " * 40),
+    (2, "Newton's laws describe how forces change the motion of bodies. " * 40),
+    (3, "Photosynthesis turns light, water and carbon dioxide into sugar. " * 40),
+]
+
+
+def test_hashing_embedder_is_deterministic_and_normalised():
+    embedder = HashingEmbedder(dim=64)
+    vectors = embedder.embed(["cells divide", "cells divide", ""])
+    assert vectors.shape == (3, 64)
+    assert np.array_equal(vectors[0], vectors[1])
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[2].any()
+
+
+def test_hashing_embedder_ranks_lexical_overlap():
+    embedder = HashingEmbedder()
+    query, close, far = embedder.embed(["energy of the cell", "the cell makes energy", "laws of motion"])
+    assert query @ close > query @ far
+
+
+def test_chunks_overlap_and_cover_the_text():
+    text = "word " * 1000
+    chunks = chunk_text(text, chunk_chars=300, overlap=50)
+    assert all(len(c) <= 300 for c in chunks)
+    assert sum(len(c) for c in chunks) > len(text.strip())
+
+
+def test_search_finds_the_right_page(tmp_path):
+    store = VectorStore(str(tmp_path), HashingEmbedder())
+    assert store.add_document(1, 10, PAGES) > 0
+    (score, file_id, page, text), *_ = store.search(1, ["how do forces change motion"], k=3)[0]
+    assert (file_id, page) == (10, 2)
+    assert "Newton" in text
+
+
+def test_batched_embedding_matches_one_batch(tmp_path):
+    batched = VectorStore(str(tmp_path / "batched"), HashingEmbedder(), chunk_chars=200, embed_batch=3)
+    whole = VectorStore(str(tmp_path / "whole"), HashingEmbedder(), chunk_chars=200, embed_batch=10_000)
+    assert batched.add_document(1, 10, iter(PAGES)) == whole.add_document(1, 10, iter(PAGES))
+    assert np.allclose(batched._index(1).vectors, whole._index(1).vectors)
+
+
+def test_replacing_and_removing_documents(tmp_path):
+    store = VectorStore(str(tmp_path), HashingEmbedder())
+    store.add_document(1, 10, PAGES[:1])
+    store.add_document(1, 11, PAGES[1:])
+    store.add_document(1, 10, PAGES[2:])
+    assert store.missing_documents(1, [10, 11, 12]) == [12]
+    store.remove_document(1, 11)
+    hits = store.search(1, ["motion of bodies"], k=100)[0]
+    assert {file_id for _, file_id, _, _ in hits} == {10}
+
+
+def test_index_saved_by_another_store_is_reloaded(tmp_path):
+    reader = VectorStore(str(tmp_path), HashingEmbedder())
+    writer = VectorStore(str(tmp_path), HashingEmbedder())
+    assert reader.missing_documents(1, [10]) == [10]
+    writer.add_document(1, 10, PAGES)
+    assert reader.missing_documents(1, [10]) == []
+
+
+def test_cached_indexes_are_bounded(tmp_path):
+    store = VectorStore(str(tmp_path), HashingEmbedder(), max_cached_sessions=2)
+    for session_id in range(5):
+        store.add_document(session_id, 10, PAGES[:1])
+    assert list(store._indexes) == [3, 4]
+    assert store.missing_documents(0, [10]) == []
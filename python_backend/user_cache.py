@@ -0,0 +1,64 @@
+"""Per-process cache of the users behind authenticated requests.
+
+Flask-Login calls the user loader on every request. Serving it from memory
+saves a database round trip each time. Entries expire after a TTL, so
+changes made by other worker processes are picked up within that window.
+Changes made in this process invalidate the entry straight away.
+"""
+
+import threading
+import time
+
+from flask_login import UserMixin
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for a User row, used as `current_user`.
+
+    Carries only the columns requests read. It is not attached to any
+    database session, so it can be shared between requests and threads.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return f"CachedUser('{self.username}')"
+
+
+class UserCache:
+    def __init__(self, ttl_seconds=60, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, load):
+        """Return the cached user, calling `load(user_id)` on a miss or after expiry.
+
+        `load` returns a CachedUser, or None if the user doesn't exist.
+        Misses are not cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and now < entry[1]:
+            return entry[0]
+
+        user = load(user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Drop expired entries first, then the oldest if that wasn't enough.
+                self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[user_id] = (user, now + self.ttl_seconds)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
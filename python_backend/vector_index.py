@@ -0,0 +1,351 @@
+"""Per-session semantic index over document chunks.
+
+Each session's chunk embeddings live in one float32 matrix (``vectors-*.npy``,
+memory-mapped on load) next to a small JSON sidecar (``meta.json``) holding
+the chunk texts, the file and page each chunk came from, and the name of the
+matrix file. Vectors are L2-normalised on the way in, so cosine top-k is a
+single matrix product.
+
+Several server processes can share the directory. Every save writes a new
+matrix file and then swaps in meta.json, so a reader never pairs one save's
+vectors with another's texts. Cached indexes are reloaded when meta.json
+changes, and writers serialise on a lock file where the platform has fcntl.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers in different processes aren't serialised.
+    fcntl = None
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+class HashingEmbedder:
+    """Deterministic, offline embedder (signed feature hashing of word unigrams and bigrams).
+
+    Useful for tests and for running without an API key; it captures lexical
+    overlap only, not paraphrase.
+    """
+
+    TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = self.TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize(matrix)
+
+
+class GeminiEmbedder:
+    """Embeds text with the Gemini embedding API, in batches."""
+
+    def __init__(self, api_base, api_key, model="text-embedding-004", dim=768, batch_size=100):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.name = model
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            body = {"requests": [
+                {"model": f"models/{self.model}", "content": {"parts": [{"text": t}]}}
+                for t in batch
+            ]}
+            try:
+                response = requests.post(
+                    f"{self.api_base}/models/{self.model}:batchEmbedContents?key={self.api_key}",
+                    json=body,
+                    timeout=(10, 60),
+                )
+            except requests.exceptions.RequestException as e:
+                raise EmbeddingError(f"Embedding request failed: {e}")
+            if response.status_code != 200:
+                raise EmbeddingError(f"Embedding request failed: {response.status_code} {response.text[:500]}")
+            vectors.extend(e["values"] for e in response.json()["embeddings"])
+        return normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim))
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def chunk_text(text, chunk_chars=1500, overlap=200):
+    """Split text into overlapping chunks, preferring to break at paragraph or sentence ends."""
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            window = text[start + chunk_chars // 2:end]
+            for sep in ("\n\n", ". ", "\n", " "):
+                cut = window.rfind(sep)
+                if cut != -1:
+                    end = start + chunk_chars // 2 + cut + len(sep)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        next_start = max(end - overlap, start + 1)
+        # Don't start the next chunk mid-word.
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+def meta_stamp(path):
+    """Identifies the current meta.json in an index directory (None if there is none).
+
+    Every save replaces the file, so the stamp changes whenever any process saves.
+    """
+    try:
+        st = os.stat(os.path.join(path, "meta.json"))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@contextmanager
+def write_lock(path):
+    """Hold an exclusive, cross-process lock on an index directory."""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SessionVectorIndex:
+    def __init__(self, path, dim, embedder_name):
+        self.path = path
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.file_ids = np.zeros(0, dtype=np.int64)
+        self.pages = np.zeros(0, dtype=np.int64)
+        self.texts = []
+        # The meta.json this was loaded from or saved as, and the matrix file it names.
+        self.stamp = None
+        self.vectors_file = None
+
+    @classmethod
+    def load(cls, path, dim, embedder_name, attempts=3):
+        for _ in range(attempts):
+            index = cls(path, dim, embedder_name)
+            index.stamp = meta_stamp(path)
+            if index.stamp is None:
+                return index
+            try:
+                with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                # Indexes written before versioned matrix files use a fixed name.
+                index.vectors_file = meta.get("vectors_file", "vectors.npy")
+                if meta["embedder"] != embedder_name or meta["dim"] != dim:
+                    # Written by a different embedder; its vectors aren't comparable.
+                    print(f"Discarding vector index at {path} built with {meta['embedder']}")
+                    return index
+                index.vectors = np.load(os.path.join(path, index.vectors_file), mmap_mode="r")
+            except (FileNotFoundError, ValueError):
+                # Another process saved (and removed the old matrix) while we read; start over.
+                continue
+            index.file_ids = np.asarray(meta["file_ids"], dtype=np.int64)
+            # Indexes written before page storage have no page numbers (0 = unknown).
+            index.pages = np.asarray(meta.get("pages") or [0] * len(meta["texts"]), dtype=np.int64)
+            index.texts = meta["texts"]
+            return index
+        raise EmbeddingError(f"Vector index at {path} kept changing while loading")
+
+    def save(self):
+        """Write the index under new file names, then swap meta.json in. Call with write_lock held."""
+        os.makedirs(self.path, exist_ok=True)
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        vectors_file = f"vectors-{token}.npy"
+        meta_tmp = os.path.join(self.path, f"meta-{token}.tmp.json")
+        np.save(os.path.join(self.path, vectors_file), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "embedder": self.embedder_name,
+                "dim": self.dim,
+                "vectors_file": vectors_file,
+                "file_ids": self.file_ids.tolist(),
+                "pages": self.pages.tolist(),
+                "texts": self.texts,
+            }, f)
+        os.replace(meta_tmp, os.path.join(self.path, "meta.json"))
+
+        previous, self.vectors_file = self.vectors_file, vectors_file
+        self.stamp = meta_stamp(self.path)
+        if previous is not None:
+            try:
+                # Readers that already mapped it keep their view of the old save.
+                os.remove(os.path.join(self.path, previous))
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, file_id, vectors, texts, pages):
+        self.vectors = np.concatenate([np.asarray(self.vectors), vectors.astype(np.float32)])
+        self.file_ids = np.concatenate([self.file_ids, np.full(len(texts), file_id, dtype=np.int64)])
+        self.pages = np.concatenate([self.pages, np.asarray(pages, dtype=np.int64)])
+        self.texts = self.texts + list(texts)
+
+    def remove(self, file_id):
+        keep = self.file_ids != file_id
+        if keep.all():
+            return False
+        self.vectors = np.asarray(self.vectors)[keep]
+        self.file_ids = self.file_ids[keep]
+        self.pages = self.pages[keep]
+        self.texts = [t for t, k in zip(self.texts, keep) if k]
+        return True
+
+    def has_file(self, file_id):
+        return bool((self.file_ids == file_id).any())
+
+    def search(self, query_vectors, k):
+        """Cosine top-k for each row of `query_vectors`. Returns one [(score, file_id, page, text)] list per query."""
+        if not len(self):
+            return [[] for _ in range(len(query_vectors))]
+        k = min(k, len(self))
+        scores = query_vectors @ np.asarray(self.vectors).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ordered = candidates[np.argsort(-scores[row, candidates])]
+            results.append([
+                (float(scores[row, i]), int(self.file_ids[i]), int(self.pages[i]), self.texts[i])
+                for i in ordered
+            ])
+        return results
+
+
+class VectorStore:
+    """Loads, caches and updates one SessionVectorIndex per chat session.
+
+    At most `max_cached_sessions` indexes are kept in memory, least recently
+    used first out. A cached index is reloaded once another process saves it.
+    """
+
+    def __init__(self, root, embedder, chunk_chars=1500, chunk_overlap=200, max_cached_sessions=64, embed_batch=100):
+        self.root = root
+        self.embedder = embedder
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        self.embed_batch = embed_batch
+        self.max_cached_sessions = max_cached_sessions
+        self._indexes = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def _path(self, session_id):
+        return os.path.join(self.root, str(session_id))
+
+    def _index(self, session_id):
+        """The session's current index. Call with the session lock held."""
+        path = self._path(session_id)
+        with self._lock:
+            index = self._indexes.get(session_id)
+        if index is None or index.stamp != meta_stamp(path):
+            index = SessionVectorIndex.load(path, self.embedder.dim, self.embedder.name)
+        with self._lock:
+            self._indexes[session_id] = index
+            self._indexes.move_to_end(session_id)
+            while len(self._indexes) > self.max_cached_sessions:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add_document(self, session_id, file_id, pages):
+        """Index a document given as (page_number, text) pairs. Chunks never span pages.
+
+        Chunks are embedded `embed_batch` at a time as the pages stream in,
+        rather than once the whole document has been read.
+        """
+        chunks = []
+        chunk_pages = []
+        batches = []
+        embedded = 0
+        for page_number, text in pages:
+            for chunk in chunk_text(text, self.chunk_chars, self.chunk_overlap):
+                chunks.append(chunk)
+                chunk_pages.append(page_number)
+            while len(chunks) - embedded >= self.embed_batch:
+                batches.append(self.embedder.embed(chunks[embedded:embedded + self.embed_batch]))
+                embedded += self.embed_batch
+        if not chunks:
+            return 0
+        if embedded < len(chunks):
+            batches.append(self.embedder.embed(chunks[embedded:]))
+        vectors = np.concatenate(batches)
+        with self._session_lock(session_id), write_lock(self._path(session_id)):
+            index = self._index(session_id)
+            index.remove(file_id)
+            index.add(file_id, vectors, chunks, chunk_pages)
+            index.save()
+        return len(chunks)
+
+    def remove_document(self, session_id, file_id):
+        if meta_stamp(self._path(session_id)) is None:
+            return
+        with self._session_lock(session_id), write_lock(self._path(session_id)):
+            index = self._index(session_id)
+            if index.remove(file_id):
+                index.save()
+
+    def drop_session(self, session_id):
+        with self._session_lock(session_id):
+            with self._lock:
+                self._indexes.pop(session_id, None)
+            shutil.rmtree(self._path(session_id), ignore_errors=True)
+
+    def missing_documents(self, session_id, file_ids):
+        with self._session_lock(session_id):
+            index = self._index(session_id)
+            return [i for i in file_ids if not index.has_file(i)]
+
+    def search(self, session_id, queries, k=8):
+        """Top-k chunks for each query string, as [(score, file_id, page, text)] lists."""
+        query_vectors = self.embedder.embed(queries)
+        with self._session_lock(session_id):
+            index = self._index(session_id)
+            return index.search(query_vectors, k)
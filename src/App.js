@@ -99,12 +99,11 @@ function App() {
 
           // Populate chat messages
           setChatContext({
-            fullText: response.data.files.map(f => f.fullText).join('\n\n'), // Combine all file texts
             contextPrompt: null, // Reset context prompt
             initialMessages: loadedMessages
           });
           // Populate document list
-          const files = response.data.files.map(f => ({ file: { name: f.filename }, summary: f.summary, fullText: f.fullText, id: f.id }));
+          const files = response.data.files.map(f => ({ file: { name: f.filename }, summary: f.summary, id: f.id }));
           setFiles(files);
           if (files.length > 0) {
             setSelectedDocumentId(files[0].id);
@@ -137,8 +136,8 @@ function App() {
     }
   }, [chatQueryFromMindmap]);
 
-  const handleMainPointClick = (fullText, mainPoint) => {
-    setChatContext({ fullText: fullText, contextPrompt: mainPoint }); // No initialMessage here
+  const handleMainPointClick = (mainPoint) => {
+    setChatContext({ contextPrompt: mainPoint }); // No initialMessage here
   };
 
   const uploadAndSummarize = async (fileToUpload) => {
@@ -166,7 +165,7 @@ function App() {
     const isFirstUpload = files.length === 0;
 
     for (const file of selectedFiles) {
-      setFiles(prevFiles => [...prevFiles, { file: file, summary: "Summarizing...", fullText: "" }]);
+      setFiles(prevFiles => [...prevFiles, { file: file, summary: "Summarizing..." }]);
 
       const result = await uploadAndSummarize(file);
       if (result && typeof result.summary === 'string') {
@@ -190,7 +189,6 @@ function App() {
             item.file === file ? { 
               ...item, 
               summary: result.summary,
-              fullText: result.fullText,
               id: result.file_id // Make sure to update the id here
             } : item
           )
@@ -201,7 +199,6 @@ function App() {
         }
         setChatContext(prev => ({
           ...prev,
-          fullText: (prev?.fullText || '') + '\n\n' + result.fullText,
           contextPrompt: null,
         }));
         setFileUploadSummary(result.summary); // Set the summary here
@@ -226,10 +223,6 @@ function App() {
       const updatedFiles = files.filter(file => file.id !== documentIdToRemove);
       setFiles(updatedFiles);
 
-      // Recalculate fullText and update chatContext
-      const updatedFullText = updatedFiles.map(f => f.fullText).join('\n\n');
-      setChatContext(prev => ({ ...prev, fullText: updatedFullText }));
-
       // If the removed document was the selected one, update the selection
       if (selectedDocumentId === documentIdToRemove) {
         setSelectedDocumentId(updatedFiles.length > 0 ? updatedFiles[0].id : null);
@@ -351,7 +344,6 @@ function App() {
             <Chat
               key={currentSessionId} // Key to force re-render when session changes
               contextPrompt={chatContext?.contextPrompt}
-              pdfContent={chatContext?.fullText}
               mindmapQuery={chatQueryFromMindmap}
               setChatQueryFromMindmap={setChatQueryFromMindmap}
               fileUploadSummary={fileUploadSummary}
@@ -380,11 +372,10 @@ function App() {
           },
         }}>
           {currentSessionId ? (
-            console.log("Session PDF Content passed to Studio:", chatContext?.fullText),
             <Studio 
               isOpen={rightPanelOpen} 
               togglePanel={() => setRightPanelOpen(!rightPanelOpen)} 
-              sessionPdfContent={chatContext?.fullText}
+              hasDocuments={files.some(f => f.id)}
               onMindmapQuery={setChatQueryFromMindmap}
               currentSessionId={currentSessionId}
               initialMindmapData={sessionData?.mindmap}
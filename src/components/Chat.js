@@ -20,7 +20,7 @@ import remarkGfm from 'remark-gfm';
 import { useNotification } from '../hooks/useNotification';
 import { EmptyChatState } from './EmptyState';
 
-function Chat({ contextPrompt, pdfContent, mindmapQuery, setChatQueryFromMindmap, fileUploadSummary, setFileUploadSummary, currentSessionId, initialMessages }) {
+function Chat({ contextPrompt, mindmapQuery, setChatQueryFromMindmap, fileUploadSummary, setFileUploadSummary, currentSessionId, initialMessages }) {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [isAIThinking, setIsAIThinking] = useState(false);
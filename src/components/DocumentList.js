@@ -11,7 +11,7 @@ function DocumentList({ files, onMainPointClick, onFileUpload, isOpen, togglePan
   const [isDragging, setIsDragging] = useState(false);
 
   const handleDocumentClick = (fileItem) => {
-    onMainPointClick(fileItem.fullText, null);
+    onMainPointClick(null);
     onDocumentSelect(fileItem.id);
   }
 
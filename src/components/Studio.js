@@ -172,7 +172,7 @@ const MindmapFlow = ({ nodes, edges, onNodesChange, onEdgesChange, onConnect, no
   );
 };
 
-function Studio({ isOpen, togglePanel, sessionPdfContent, onMindmapQuery, currentSessionId, initialMindmapData, documentId }) {
+function Studio({ isOpen, togglePanel, hasDocuments, onMindmapQuery, currentSessionId, initialMindmapData, documentId }) {
   const theme = useTheme();
   const isDarkMode = theme.palette.mode === 'dark';
   const [nodes, setNodes] = useState([]);
@@ -439,7 +439,6 @@ function Studio({ isOpen, togglePanel, sessionPdfContent, onMindmapQuery, curren
     setLoading(true);
     try {
       const response = await axios.post('http://localhost:5000/generate-mindmap', {
-        fullText: sessionPdfContent,
         session_id: currentSessionId,
       }, { withCredentials: true, timeout: 120000 });
 
@@ -525,7 +524,7 @@ function Studio({ isOpen, togglePanel, sessionPdfContent, onMindmapQuery, curren
       showError("Please select a session first.");
       return;
     }
-    if (!sessionPdfContent && !customText) {
+    if (!hasDocuments && !customText) {
       showError("No document content available in this session to generate notes from.");
       return;
     }
@@ -603,7 +602,7 @@ function Studio({ isOpen, togglePanel, sessionPdfContent, onMindmapQuery, curren
             variant="contained"
             fullWidth
             onClick={() => generateMindmap()}
-            disabled={loading || !sessionPdfContent}
+            disabled={loading || !hasDocuments}
             sx={{ 
               mb: 1.5, 
               borderRadius: '10px',
@@ -631,7 +630,7 @@ function Studio({ isOpen, togglePanel, sessionPdfContent, onMindmapQuery, curren
             variant="contained"
             fullWidth
             onClick={handleGlobalNotesClick}
-            disabled={loading || !sessionPdfContent || notesLoading}
+            disabled={loading || !hasDocuments || notesLoading}
             sx={{ 
               mb: 1.5, 
               borderRadius: '10px',